@@ -1,37 +1,50 @@
+import time
+
+# Начало импорта — точка отсчёта профиля запуска
+IMPORT_STARTED = time.perf_counter()
+
 import os
+import sys
+import hmac
+import json
+import re
+import signal
+import asyncio
 import logging
-import sqlite3
-import threading
+from contextlib import contextmanager
 from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
 
-# Добавьте этот класс для обработки пингов от Render (для BotHost не обязателен, но пусть будет)
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(b"Bot is running!")
-    
-    def log_message(self, format, *args):
-        # Отключаем логирование запросов
-        pass
+import db
+import logs
+from cache import ALL_MONTHS, render_cache
+from export import FORMATS, WRITERS, read_csv_gz, write_csv_gz
+from health import HealthServer
+from logs import log_fields
+from migrations import MIGRATIONS
+from monitoring import HANDLER_LATENCY, StartupProfile, TimedHTTPXRequest, loop_lag, metrics
+from persistence import SQLitePersistence
+from processing import PerUserUpdateProcessor
+from router import CallbackCodec, CallbackRouter
+from search import build_match, parse_query, tokens
 
-# Функция для запуска HTTP сервера (для BotHost не обязательна, но пусть будет)
-def run_health_server():
-    port = int(os.environ.get('PORT', 10000))
-    server = HTTPServer(('0.0.0.0', port), HealthCheckHandler)
-    print(f"Health check server running on port {port}")
-    server.serve_forever()
+logger = logging.getLogger(__name__)
 
-# Запускаем health check сервер в отдельном потоке
-health_thread = threading.Thread(target=run_health_server, daemon=True)
-health_thread.start()
+# Уровень логов и ограничения по категориям: LOG_SAMPLE — доля записей ниже WARNING,
+# LOG_RATE_LIMIT — записей в секунду, например LOG_SAMPLE="callback=0.1"
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE = os.environ.get('LOG_SAMPLE', '')
+LOG_RATE_LIMIT = os.environ.get('LOG_RATE_LIMIT', 'update=50,callback=50')
 
-# Настройка логирования
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
-logger = logging.getLogger(__name__)
+def setup_logging():
+    """Логи пишутся в очередь, а выводит их фоновый поток: обработчики не ждут stdout.
+    Вызывается при запуске, а не при импорте"""
+    handler, category_filter = logs.setup(LOG_LEVEL, logs.parse_limits(LOG_SAMPLE),
+                                          logs.parse_limits(LOG_RATE_LIMIT))
+    metrics.gauge('bot_log_queue_depth', 'Записей лога в очереди на вывод', handler.queue.qsize)
+    metrics.gauge('bot_log_dropped_total', 'Записей лога, отброшенных сэмплированием, лимитами и переполнением',
+                  lambda: category_filter.dropped + handler.dropped, 'counter')
 
 # Список сотрудников
 EMPLOYEES = ["Наринэ", "Катя_К", "Жанна", "Августина", "Лилит", "Настя", "Ира", "Юля", "Катя_С", "Богдан"]
@@ -45,808 +58,1969 @@ FINES = {
     15: ["👋 Не здороваемся", "🍔/👕 Еда / личн.вещи в раб.зоне", "🙅‍♂️ Зона самообслуж.", "🧹 Крошки/грязь в зале", "🚪 Не открыта вх.дверь", "😣 Прочее"]
 }
 
+def safe_callback(text: str) -> str:
+    """Заменяет пробелы и специальные символы на _ для callback_data"""
+    return text.replace(' ', '_').replace('/', '_').replace('\\', '_')
+
+# ============= СПРАВОЧНИКИ И КЛАВИАТУРЫ (строятся один раз) =============
+
+MONTH_NAMES = ("Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+               "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь")
+
+# Плоский каталог нарушений в порядке показа: (сумма, причина)
+FINE_CATALOG = tuple((amount, reason) for amount, reasons in FINES.items() for reason in reasons)
+
+# Обратный поиск сотрудника по безопасному имени из callback_data старого формата
+EMPLOYEE_BY_CALLBACK = {safe_callback(emp): emp for emp in EMPLOYEES}
+
+# Схема callback_data для маршрутов с аргументами: имя -> (код, типы аргументов).
+# Сотрудники и нарушения кодируются id из таблиц employees и fine_types (см. refresh_catalog)
+CALLBACK_SCHEMA = {
+    "emp_fine_": ("ef", ("employee",)),
+    "fine_": ("f", ("fine",)),
+    "adjust_emp_": ("ae", ("employee",)),
+    "delete_last_": ("dl", ("employee",)),
+    "delete_fine_": ("df", ("int",)),
+    "view_employee_": ("ve", ("employee",)),
+    "month_": ("m", ("month",)),
+    "month_emp_": ("me", ("month", "employee")),
+    "months_page_": ("mp", ("int", "month")),
+    "month_page_": ("mq", ("month", "int", "int", "employee")),
+    "adjust_page_": ("ap", ("employee", "int", "int")),
+    "batch_emp_": ("be", ("employee",)),
+    "batch_type_": ("bt", ("fine",)),
+    "export_month_": ("xm", ("int", "month")),
+    "export_all_": ("xa", ("int",)),
+    "search_page_": ("sp", ("int",)),
+}
+
+router = CallbackRouter(CallbackCodec(), CALLBACK_SCHEMA)
+
+# Длинные списки показываются страницами по PAGE_SIZE кнопок. Страница
+# задаётся курсором — ключом крайней строки соседней страницы — и направлением
+PAGE_SIZE = 10
+PAGE_FORWARD = 0
+PAGE_BACKWARD = 1
+
+def _keyboard(*rows):
+    return InlineKeyboardMarkup(tuple(tuple(row) for row in rows))
+
+MAIN_MENU_BUTTON = InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")
+
+ADMIN_MENU_KEYBOARD = _keyboard(
+    [InlineKeyboardButton("📝 Добавить штраф", callback_data="add_fine")],
+    [InlineKeyboardButton("👥 Групповой штраф", callback_data="batch_fine")],
+    [InlineKeyboardButton("📊 Текущий месяц", callback_data="check_fines")],
+    [InlineKeyboardButton("📅 Архив месяцев", callback_data="show_months")],
+    [InlineKeyboardButton("📈 Тренды", callback_data="trends")],
+    [InlineKeyboardButton("✏️ Корректировка штрафов", callback_data="adjust_fines")],
+    [InlineKeyboardButton("📤 Экспорт", callback_data="export")],
+)
+
+USER_MENU_KEYBOARD = _keyboard(
+    [InlineKeyboardButton("📊 Текущий месяц", callback_data="check_fines")],
+    [InlineKeyboardButton("📅 Архив месяцев", callback_data="show_months")],
+    [InlineKeyboardButton("📈 Тренды", callback_data="trends")],
+)
+
+MAIN_MENU_KEYBOARD = _keyboard([MAIN_MENU_BUTTON])
+
+NO_RIGHTS_KEYBOARD = _keyboard([InlineKeyboardButton("◀️ В главное меню", callback_data="main_menu")])
+
+# Клавиатуры с id из справочников строит refresh_catalog после открытия базы
+EMPLOYEE_KEYBOARD = None
+FINE_KEYBOARD = None
+
+AFTER_FINE_KEYBOARD = _keyboard(
+    [InlineKeyboardButton("📝 Добавить ещё штраф", callback_data="add_fine")],
+    [InlineKeyboardButton("✏️ Корректировка штрафов", callback_data="adjust_fines")],
+    [MAIN_MENU_BUTTON],
+)
+
+EMPTY_MONTH_ADMIN_KEYBOARD = _keyboard(
+    [InlineKeyboardButton("📝 Добавить штраф", callback_data="add_fine")],
+    [MAIN_MENU_BUTTON],
+)
+
+EMPTY_ARCHIVE_MONTH_KEYBOARD = _keyboard([
+    InlineKeyboardButton("◀️ Назад к месяцам", callback_data="show_months"),
+    MAIN_MENU_BUTTON,
+])
+
+def format_month(month):
+    """YYYY-MM -> (название месяца, год)"""
+    year, month_num = month.split('-')
+    return MONTH_NAMES[int(month_num) - 1], year
+
+SPARK_BARS = "▁▂▃▄▅▆▇█"
+
+def sparkline(values):
+    """Столбики из SPARK_BARS по максимуму ряда; ноль — самый низкий столбик"""
+    peak = max(values, default=0)
+    if peak <= 0:
+        return SPARK_BARS[0] * len(values)
+    steps = len(SPARK_BARS) - 2
+    return "".join(SPARK_BARS[1 + round(value * steps / peak)] if value > 0 else SPARK_BARS[0]
+                   for value in values)
+
 def init_db():
-    """Инициализация базы данных"""
-    conn = sqlite3.connect('fines.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS fines 
-                 (id INTEGER PRIMARY KEY, employee TEXT, amount INTEGER, 
-                  reason TEXT, date TEXT, month TEXT)''')
-    
-    # Таблица для хранения ID администраторов в БД (на случай, если нужно будет добавлять через бота)
-    c.execute('''CREATE TABLE IF NOT EXISTS admins 
-                 (user_id INTEGER PRIMARY KEY, username TEXT, added_date TEXT)''')
-    conn.commit()
-    conn.close()
+    """Инициализация базы данных: применяет недостающие миграции схемы
+    и добавляет в справочники новых сотрудников и нарушения"""
+    for version, description in db.migrate(MIGRATIONS):
+        logger.info(f"✅ Миграция БД: {description}", extra=log_fields('db', version=version))
+    sync_catalog()
+    refresh_catalog()
+
+# Реестр администраторов: ADMIN_IDS + таблица admins, загружается один раз при старте
+_admin_ids = frozenset(ADMIN_IDS)
+
+def refresh_admins():
+    """Перечитывает таблицу admins. Вызывать после каждого изменения таблицы"""
+    global _admin_ids
+    db_admins = [row[0] for row in db.fetch_all('SELECT user_id FROM admins')]
+    _admin_ids = frozenset(ADMIN_IDS).union(db_admins)
+    logger.info("Загружены администраторы", extra=log_fields('admin', total=len(_admin_ids), from_db=len(db_admins)))
+
+def add_admin(user_id, username=None):
+    """Добавляет администратора в БД и обновляет реестр"""
+    with db.transaction() as conn:
+        conn.execute('INSERT OR REPLACE INTO admins (user_id, username, added_date) VALUES (?,?,?)',
+                     (user_id, username, datetime.now().strftime("%Y-%m-%d %H:%M")))
+    refresh_admins()
+
+def remove_admin(user_id):
+    """Удаляет администратора из БД и обновляет реестр"""
+    with db.transaction() as conn:
+        conn.execute('DELETE FROM admins WHERE user_id=?', (user_id,))
+    refresh_admins()
+
+def get_db_admins():
+    """Администраторы из таблицы admins: (user_id, username, дата добавления)"""
+    return db.fetch_all('SELECT user_id, username, added_date FROM admins ORDER BY user_id')
 
 def is_admin(user_id: int) -> bool:
-    """Проверяет, является ли пользователь администратором"""
-    # Проверяем по списку ADMIN_IDS
-    if user_id in ADMIN_IDS:
-        print(f"✅ Админ {user_id} найден в списке ADMIN_IDS")
-        return True
-    
-    print(f"❌ Пользователь {user_id} НЕ в списке ADMIN_IDS: {ADMIN_IDS}")
-    
-    # Также проверяем в базе данных (на случай динамического добавления)
-    try:
-        conn = sqlite3.connect('fines.db')
-        c = conn.cursor()
-        c.execute('SELECT user_id FROM admins WHERE user_id = ?', (user_id,))
-        result = c.fetchone()
-        conn.close()
-        
-        if result:
-            print(f"✅ Админ {user_id} найден в БД")
-            return True
-        else:
-            print(f"❌ Админ {user_id} НЕ найден в БД")
-    except Exception as e:
-        print(f"Ошибка при проверке БД: {e}")
-    
-    return False
+    """Проверяет, является ли пользователь администратором (без обращения к БД)"""
+    return user_id in _admin_ids
 
 def get_current_month():
     return datetime.now().strftime("%Y-%m")
 
+def parse_month(text):
+    """Месяц из ввода пользователя -> канонический YYYY-MM («2025-7» -> «2025-07»).
+    ValueError — не месяц"""
+    try:
+        return datetime.strptime(text.strip(), "%Y-%m").strftime("%Y-%m")
+    except ValueError:
+        raise ValueError(f"Неверный месяц {text!r}: ожидается ГГГГ-ММ") from None
+
+def month_bounds(month):
+    """YYYY-MM -> [начало, конец) месяца в секундах epoch по местному времени"""
+    year, month_num = map(int, month.split('-'))
+    start = datetime(year, month_num, 1)
+    end = datetime(year + month_num // 12, month_num % 12 + 1, 1)
+    return int(start.timestamp()), int(end.timestamp())
+
+def month_of(timestamp):
+    """Секунды epoch -> YYYY-MM по местному времени"""
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m")
+
+def format_timestamp(timestamp, fmt="%Y-%m-%d %H:%M"):
+    return datetime.fromtimestamp(timestamp).strftime(fmt)
+
+# ============= СПРАВОЧНИКИ =============
+
+# Подзапрос id сотрудника по имени: хелперы принимают имена, а fines и
+# monthly_totals хранят только id
+_EMPLOYEE_ID = '(SELECT id FROM employees WHERE name=?)'
+
+def sync_catalog():
+    """Добавляет в employees и fine_types сотрудников и нарушения из EMPLOYEES и FINES"""
+    with db.transaction() as conn:
+        conn.executemany('INSERT OR IGNORE INTO employees (name) VALUES (?)', [(emp,) for emp in EMPLOYEES])
+        conn.executemany('INSERT OR IGNORE INTO fine_types (amount, reason) VALUES (?,?)', FINE_CATALOG)
+
+# Справочники из базы: (сумма, причина) -> fine_types.id и fine_types.id -> (сумма, причина).
+# Сотрудники — в router.codec. Загружаются в init_db и перечитываются, когда справочник пополняется
+FINE_TYPE_IDS = {}
+FINE_BY_ID = {}
+# Словарь термов поиска (см. get_search_vocabulary)
+_search_vocabulary = frozenset()
+
+def refresh_catalog():
+    """Перечитывает employees и fine_types: их id кодируются в callback_data.
+    Заодно перестраивает клавиатуры выбора сотрудника и нарушения"""
+    global FINE_TYPE_IDS, FINE_BY_ID, EMPLOYEE_KEYBOARD, FINE_KEYBOARD, _search_vocabulary
+    employees = dict(db.fetch_all('SELECT id, name FROM employees'))
+    fines = {fine_type_id: (amount, reason)
+             for fine_type_id, amount, reason in db.fetch_all('SELECT id, amount, reason FROM fine_types')}
+    router.codec.load(employees, fines)
+    FINE_BY_ID = fines
+    FINE_TYPE_IDS = {fine: fine_type_id for fine_type_id, fine in fines.items()}
+    _search_vocabulary = frozenset(term for text in [*employees.values(), *(reason for amount, reason in fines.values())]
+                                   for term in tokens(text))
+
+    EMPLOYEE_KEYBOARD = _keyboard(
+        *[[InlineKeyboardButton(emp, callback_data=router.data("emp_fine_", emp))] for emp in EMPLOYEES],
+        [MAIN_MENU_BUTTON],
+    )
+    FINE_KEYBOARD = _keyboard(
+        *[[InlineKeyboardButton(f"{reason} ({amount} баллов)",
+                                callback_data=router.data("fine_", FINE_TYPE_IDS[amount, reason]))]
+          for amount, reason in FINE_CATALOG],
+        [InlineKeyboardButton("◀️ Назад к сотрудникам", callback_data="add_fine")],
+        [MAIN_MENU_BUTTON],
+    )
+
+def _catalog_id(conn, employee, amount, reason):
+    """id сотрудника и нарушения; отсутствующие в справочниках добавляются"""
+    ids = []
+    for select, insert, params in (
+        ('SELECT id FROM employees WHERE name=?', 'INSERT INTO employees (name) VALUES (?)', (employee,)),
+        ('SELECT id FROM fine_types WHERE reason=? AND amount=?',
+         'INSERT INTO fine_types (reason, amount) VALUES (?,?)', (reason, amount)),
+    ):
+        row = conn.execute(select, params).fetchone()
+        ids.append(row[0] if row else conn.execute(insert, params).lastrowid)
+    return tuple(ids)
+
+def _add_to_monthly_totals(conn, month, rows):
+    """Прибавляет к monthly_totals строки (employee_id, fine_type_id, количество, сумма, время)"""
+    conn.executemany('''
+        INSERT INTO monthly_totals (month, employee_id, fine_type_id, fine_count, total, last_at)
+        VALUES (?,?,?,?,?,?)
+        ON CONFLICT (month, employee_id, fine_type_id) DO UPDATE SET
+            fine_count = fine_count + excluded.fine_count,
+            total = total + excluded.total,
+            last_at = MAX(last_at, excluded.last_at)
+    ''', [(month,) + row for row in rows])
+
+def _update_monthly_totals(conn, month, employee_id, fine_type_id, amount, created_at, sign):
+    """Обновляет строку monthly_totals при добавлении (sign=1) или удалении (sign=-1) штрафа.
+    Вызывается внутри транзакции, которая меняет fines"""
+    if sign > 0:
+        _add_to_monthly_totals(conn, month, [(employee_id, fine_type_id, 1, amount, created_at)])
+        return
+
+    conn.execute('''
+        UPDATE monthly_totals SET fine_count = fine_count - 1, total = total - ?
+        WHERE month=? AND employee_id=? AND fine_type_id=?
+    ''', (amount, month, employee_id, fine_type_id))
+    conn.execute('''
+        DELETE FROM monthly_totals
+        WHERE month=? AND employee_id=? AND fine_type_id=? AND fine_count <= 0
+    ''', (month, employee_id, fine_type_id))
+    # Время последнего штрафа могло измениться — пересчитываем по индексу
+    start, end = month_bounds(month)
+    conn.execute('''
+        UPDATE monthly_totals SET last_at = (
+            SELECT MAX(created_at) FROM fines
+            WHERE employee_id=? AND created_at >= ? AND created_at < ? AND fine_type_id=?
+        )
+        WHERE month=? AND employee_id=? AND fine_type_id=?
+    ''', (employee_id, start, end, fine_type_id, month, employee_id, fine_type_id))
+
+def _index_fines(conn, where, params):
+    """Добавляет в fines_fts штрафы, подходящие под условие where (по f.*)"""
+    conn.execute(f'''
+        INSERT INTO fines_fts (rowid, employee, reason)
+        SELECT f.id, e.name, t.reason
+        FROM fines f JOIN employees e ON e.id = f.employee_id JOIN fine_types t ON t.id = f.fine_type_id
+        WHERE {where}
+    ''', params)
+
+def _unindex_fines(conn, where, params):
+    """Убирает из fines_fts штрафы по условию where. Вызывать до DELETE из fines:
+    индексу external content нужны удаляемые значения"""
+    conn.execute(f'''
+        INSERT INTO fines_fts (fines_fts, rowid, employee, reason)
+        SELECT 'delete', f.id, e.name, t.reason
+        FROM fines f JOIN employees e ON e.id = f.employee_id JOIN fine_types t ON t.id = f.fine_type_id
+        WHERE {where}
+    ''', params)
+
 def add_fine(employee, amount, reason):
-    conn = sqlite3.connect('fines.db')
-    c = conn.cursor()
-    c.execute('INSERT INTO fines (employee, amount, reason, date, month) VALUES (?,?,?,?,?)',
-              (employee, amount, reason, datetime.now().strftime("%Y-%m-%d %H:%M"), get_current_month()))
-    conn.commit()
-    conn.close()
+    add_fines([(employee, amount, reason)])
+
+def add_fines(fines):
+    """Добавляет штрафы (сотрудник, сумма, причина) одной транзакцией: строки
+    fines — одним executemany, monthly_totals — одной строкой на сотрудника
+    и причину. Возвращает количество добавленных штрафов"""
+    if not fines:
+        return 0
+    created_at = int(time.time())
+    month = month_of(created_at)
+    with db.transaction() as conn:
+        ids = {}
+        for fine in fines:
+            if fine not in ids:
+                ids[fine] = _catalog_id(conn, *fine)
+        last_id = conn.execute('SELECT MAX(id) FROM fines').fetchone()[0] or 0
+        conn.executemany('INSERT INTO fines (employee_id, fine_type_id, created_at) VALUES (?,?,?)',
+                         [(*ids[fine], created_at) for fine in fines])
+        _index_fines(conn, 'f.id > ?', (last_id,))
+        totals = {}
+        for fine in fines:
+            count, total = totals.get(ids[fine], (0, 0))
+            totals[ids[fine]] = (count + 1, total + fine[1])
+        _add_to_monthly_totals(conn, month, [key + (count, total, created_at)
+                                             for key, (count, total) in totals.items()])
+    render_cache.invalidate_month(month)
+    # Сотрудник или нарушение не из справочника добавлены в _catalog_id — их id нужны кнопкам
+    if any(employee not in router.codec.employee_ids or (amount, reason) not in FINE_TYPE_IDS
+           for employee, amount, reason in ids):
+        refresh_catalog()
+    return len(fines)
 
 def remove_last_fine(employee):
     """Удаляет последний штраф сотрудника за текущий месяц"""
-    conn = sqlite3.connect('fines.db')
-    c = conn.cursor()
     current_month = get_current_month()
-    
-    c.execute('''
-        SELECT id, amount, reason FROM fines 
-        WHERE month=? AND employee=? 
-        ORDER BY date DESC LIMIT 1
-    ''', (current_month, employee))
-    
-    last_fine = c.fetchone()
-    
-    if last_fine:
-        c.execute('DELETE FROM fines WHERE id=?', (last_fine[0],))
-        conn.commit()
-        conn.close()
-        return last_fine
-    
-    conn.close()
-    return None
+    start, end = month_bounds(current_month)
+
+    with db.transaction() as conn:
+        # Время до секунды и id как второй ключ — порядок точный даже для штрафов в одну секунду
+        last_fine = conn.execute(f'''
+            SELECT f.id, f.employee_id, f.fine_type_id, t.amount, t.reason, f.created_at
+            FROM fines f JOIN fine_types t ON t.id = f.fine_type_id
+            WHERE f.employee_id={_EMPLOYEE_ID} AND f.created_at >= ? AND f.created_at < ?
+            ORDER BY f.created_at DESC, f.id DESC LIMIT 1
+        ''', (employee, start, end)).fetchone()
+
+        if not last_fine:
+            return None
+
+        fine_id, employee_id, fine_type_id, amount, reason, created_at = last_fine
+        _unindex_fines(conn, 'f.id = ?', (fine_id,))
+        conn.execute('DELETE FROM fines WHERE id=?', (fine_id,))
+        _update_monthly_totals(conn, current_month, employee_id, fine_type_id, amount, created_at, -1)
+    render_cache.invalidate_month(current_month)
+
+    return fine_id, amount, reason
 
 def get_employee_total(employee):
     """Получает общую сумму штрафов сотрудника за текущий месяц"""
-    conn = sqlite3.connect('fines.db')
-    c = conn.cursor()
-    current_month = get_current_month()
-    
-    c.execute('SELECT SUM(amount) FROM fines WHERE month=? AND employee=?', (current_month, employee))
-    total = c.fetchone()[0]
-    conn.close()
-    
-    return total if total else 0
+    return db.fetch_value(f'SELECT SUM(total) FROM monthly_totals WHERE month=? AND employee_id={_EMPLOYEE_ID}',
+                          (get_current_month(), employee), 0)
 
-def get_employee_fines_list(employee):
-    """Получает список всех штрафов сотрудника за текущий месяц"""
-    conn = sqlite3.connect('fines.db')
-    c = conn.cursor()
-    current_month = get_current_month()
-    
-    c.execute('''
-        SELECT id, amount, reason, date FROM fines 
-        WHERE month=? AND employee=? 
-        ORDER BY date DESC
-    ''', (current_month, employee))
-    
-    results = c.fetchall()
-    conn.close()
-    
-    return results
+def get_employee_total_and_count(employee):
+    """Получает сумму и количество штрафов сотрудника за текущий месяц"""
+    total, count = db.fetch_one(
+        f'SELECT SUM(total), SUM(fine_count) FROM monthly_totals WHERE month=? AND employee_id={_EMPLOYEE_ID}',
+        (get_current_month(), employee))
+    return total or 0, count or 0
+
+def _keyset_page(fetch, cursor, backward, limit):
+    """Страница keyset-пагинации: (строки, есть предыдущие, есть следующие).
+
+    fetch(cursor, backward, n) возвращает до n строк после курсора (при
+    backward — перед ним, в обратном порядке); cursor=None — с начала списка"""
+    rows = fetch(cursor, backward, limit + 1)
+    if not rows and cursor is not None:
+        # Строка курсора удалена или список сократился — показываем начало
+        return _keyset_page(fetch, None, False, limit)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        return rows[::-1], more, True
+    return rows, cursor is not None, more
+
+def get_employee_fines_list(employee, cursor=None, backward=False, limit=PAGE_SIZE):
+    """Страница штрафов сотрудника за текущий месяц, от новых к старым.
+    Курсор — id штрафа; строки (id, сумма, причина, время в секундах epoch)"""
+    start, end = month_bounds(get_current_month())
+
+    def fetch(cursor, backward, n):
+        where, order, params = '', 'f.created_at DESC, f.id DESC', ()
+        if cursor is not None:
+            compare = '>' if backward else '<'
+            where = f'AND (f.created_at, f.id) {compare} ((SELECT created_at FROM fines WHERE id=?), ?)'
+            params = (cursor, cursor)
+            if backward:
+                order = 'f.created_at, f.id'
+        return db.fetch_all(f'''
+            SELECT f.id, t.amount, t.reason, f.created_at
+            FROM fines f JOIN fine_types t ON t.id = f.fine_type_id
+            WHERE f.employee_id={_EMPLOYEE_ID} AND f.created_at >= ? AND f.created_at < ? {where}
+            ORDER BY {order} LIMIT ?
+        ''', (employee, start, end) + params + (n,))
+
+    return _keyset_page(fetch, cursor, backward, limit)
 
 def get_employee_fines_summary(employee):
     """Получает сводку штрафов сотрудника с группировкой по причинам"""
-    conn = sqlite3.connect('fines.db')
-    c = conn.cursor()
-    current_month = get_current_month()
-    
-    # Получаем общую сумму
-    c.execute('SELECT SUM(amount) FROM fines WHERE month=? AND employee=?', (current_month, employee))
-    total = c.fetchone()[0] or 0
-    
-    # Получаем группировку по причинам с количеством
-    c.execute('''
-        SELECT reason, COUNT(*) as count, SUM(amount) as total_amount 
-        FROM fines 
-        WHERE month=? AND employee=? 
-        GROUP BY reason 
-        ORDER BY total_amount DESC
-    ''', (current_month, employee))
-    
-    reasons_summary = c.fetchall()
-    conn.close()
-    
-    return total, reasons_summary
+    return get_employee_fines_summary_by_month(employee, get_current_month())
+
+def get_fine(fine_id):
+    """Получает сотрудника, сумму и причину штрафа по ID"""
+    return db.fetch_one('''
+        SELECT e.name, t.amount, t.reason
+        FROM fines f
+        JOIN employees e ON e.id = f.employee_id
+        JOIN fine_types t ON t.id = f.fine_type_id
+        WHERE f.id=?
+    ''', (fine_id,))
 
 def delete_specific_fine(fine_id):
     """Удаляет конкретный штраф по ID"""
-    conn = sqlite3.connect('fines.db')
-    c = conn.cursor()
-    
-    c.execute('DELETE FROM fines WHERE id=?', (fine_id,))
-    conn.commit()
-    conn.close()
+    with db.transaction() as conn:
+        fine = conn.execute('''
+            SELECT f.employee_id, f.fine_type_id, t.amount, f.created_at
+            FROM fines f JOIN fine_types t ON t.id = f.fine_type_id
+            WHERE f.id=?
+        ''', (fine_id,)).fetchone()
+        if not fine:
+            return
+        month = month_of(fine[3])
+        _unindex_fines(conn, 'f.id = ?', (fine_id,))
+        conn.execute('DELETE FROM fines WHERE id=?', (fine_id,))
+        _update_monthly_totals(conn, month, *fine, -1)
+    render_cache.invalidate_month(month)
+
+def get_month_snapshot(month=None):
+    """Получает за месяц всех сотрудников со штрафами одним запросом:
+    список (сотрудник, сумма, количество, время последнего штрафа), по имени"""
+    return db.fetch_all('''
+        SELECT e.name, SUM(mt.total), SUM(mt.fine_count), MAX(mt.last_at)
+        FROM monthly_totals mt JOIN employees e ON e.id = mt.employee_id
+        WHERE mt.month=?
+        GROUP BY mt.employee_id
+        ORDER BY e.name
+    ''', (month or get_current_month(),))
+
+def get_month_ranking(month, cursor=None, backward=False, limit=PAGE_SIZE):
+    """Страница сотрудников за месяц по убыванию суммы. Курсор — (сумма, сотрудник);
+    строки (сотрудник, сумма, количество, время последнего штрафа)"""
+    def fetch(cursor, backward, n):
+        having, order, params = '', 'ORDER BY 2 DESC, 1', ()
+        if cursor is not None:
+            total, employee = cursor
+            if backward:
+                having, order = 'HAVING SUM(mt.total) > ? OR (SUM(mt.total) = ? AND e.name < ?)', 'ORDER BY 2, 1 DESC'
+            else:
+                having = 'HAVING SUM(mt.total) < ? OR (SUM(mt.total) = ? AND e.name > ?)'
+            params = (total, total, employee)
+        return db.fetch_all(f'''
+            SELECT e.name, SUM(mt.total), SUM(mt.fine_count), MAX(mt.last_at)
+            FROM monthly_totals mt JOIN employees e ON e.id = mt.employee_id
+            WHERE mt.month=?
+            GROUP BY mt.employee_id {having}
+            {order} LIMIT ?
+        ''', (month,) + params + (n,))
+
+    return _keyset_page(fetch, cursor, backward, limit)
 
 def get_all_employees_with_fines():
     """Получает список всех сотрудников, у которых есть штрафы в текущем месяце"""
-    conn = sqlite3.connect('fines.db')
-    c = conn.cursor()
-    current_month = get_current_month()
-    
-    c.execute('''
-        SELECT DISTINCT employee FROM fines 
-        WHERE month=? 
-        ORDER BY employee
-    ''', (current_month,))
-    
-    results = [row[0] for row in c.fetchall()]
-    conn.close()
-    
-    return results
+    return [row[0] for row in get_month_snapshot()]
 
 def get_monthly_fines():
-    conn = sqlite3.connect('fines.db')
-    c = conn.cursor()
-    c.execute('SELECT employee, SUM(amount) FROM fines WHERE month=? GROUP BY employee', (get_current_month(),))
-    results = dict(c.fetchall())
-    conn.close()
-    return results
+    return get_monthly_fines_by_month(get_current_month())
 
 # ============= НОВЫЕ ФУНКЦИИ ДЛЯ АРХИВА МЕСЯЦЕВ =============
 
-def get_available_months():
-    """Получает список всех месяцев, за которые есть штрафы"""
-    conn = sqlite3.connect('fines.db')
-    c = conn.cursor()
-    c.execute('SELECT DISTINCT month FROM fines ORDER BY month DESC')
-    results = [row[0] for row in c.fetchall()]
-    conn.close()
-    return results
+def get_available_months(cursor=None, backward=False, limit=PAGE_SIZE):
+    """Страница месяцев, за которые есть штрафы, от новых к старым. Курсор — месяц"""
+    def fetch(cursor, backward, n):
+        if cursor is None:
+            rows = db.fetch_all('SELECT DISTINCT month FROM monthly_totals ORDER BY month DESC LIMIT ?', (n,))
+        elif backward:
+            rows = db.fetch_all('SELECT DISTINCT month FROM monthly_totals WHERE month > ? ORDER BY month LIMIT ?',
+                                (cursor, n))
+        else:
+            rows = db.fetch_all('SELECT DISTINCT month FROM monthly_totals WHERE month < ? ORDER BY month DESC LIMIT ?',
+                                (cursor, n))
+        return [row[0] for row in rows]
+    
+    return _keyset_page(fetch, cursor, backward, limit)
 
 def get_monthly_fines_by_month(month):
     """Получает штрафы за конкретный месяц"""
-    conn = sqlite3.connect('fines.db')
-    c = conn.cursor()
-    c.execute('SELECT employee, SUM(amount) FROM fines WHERE month=? GROUP BY employee', (month,))
-    results = dict(c.fetchall())
-    conn.close()
-    return results
+    return {emp: total for emp, total, count, last_at in get_month_snapshot(month)}
 
 def get_employee_fines_summary_by_month(employee, month):
     """Получает сводку штрафов сотрудника за конкретный месяц"""
-    conn = sqlite3.connect('fines.db')
-    c = conn.cursor()
-    
-    # Получаем общую сумму
-    c.execute('SELECT SUM(amount) FROM fines WHERE month=? AND employee=?', (month, employee))
-    total = c.fetchone()[0] or 0
-    
-    # Получаем группировку по причинам
-    c.execute('''
-        SELECT reason, COUNT(*) as count, SUM(amount) as total_amount 
-        FROM fines 
-        WHERE month=? AND employee=? 
-        GROUP BY reason 
-        ORDER BY total_amount DESC
+    # Группировка по причинам уже посчитана в monthly_totals
+    reasons_summary = db.fetch_all(f'''
+        SELECT t.reason, mt.fine_count, mt.total
+        FROM monthly_totals mt JOIN fine_types t ON t.id = mt.fine_type_id
+        WHERE mt.month=? AND mt.employee_id={_EMPLOYEE_ID}
+        ORDER BY mt.total DESC
     ''', (month, employee))
     
-    reasons_summary = c.fetchall()
-    conn.close()
-    
+    total = sum(row[2] for row in reasons_summary)
     return total, reasons_summary
 
-def safe_callback(text: str) -> str:
-    """Заменяет пробелы и специальные символы на _ для callback_data"""
-    return text.replace(' ', '_').replace('/', '_').replace('\\', '_')
+# ============= ТРЕНДЫ =============
 
-# ============================================================
+# Сколько последних месяцев со штрафами показывать и сколько частых нарушений на сотрудника
+TREND_MONTHS = 6
+TREND_TOP_REASONS = 2
 
-async def main_menu(update_or_query, context: ContextTypes.DEFAULT_TYPE, text="Главное меню:"):
-    """Показывает главное меню с учетом прав пользователя"""
-    user_id = update_or_query.effective_user.id if hasattr(update_or_query, 'effective_user') else update_or_query.from_user.id
+def get_employee_trends(months=TREND_MONTHS, top_reasons=TREND_TOP_REASONS):
+    """Тренды сотрудников за последние months месяцев, за которые есть штрафы.
+    Один запрос с оконными функциями по monthly_totals; для скользящего среднего
+    и изменения к прошлому месяцу берутся ещё два месяца до периода.
+    Возвращает {сотрудник: ([(месяц, сумма, количество, изменение или None,
+    среднее за 3 месяца)] по возрастанию месяца, [(причина, в скольких месяцах,
+    сколько раз)])} — сотрудники со штрафами за период"""
+    rows = db.fetch_all('''
+        WITH months AS (
+            SELECT month, ROW_NUMBER() OVER (ORDER BY month DESC) AS n
+            FROM (SELECT DISTINCT month FROM monthly_totals ORDER BY month DESC LIMIT ?)
+        ),
+        per_month AS (
+            SELECT employee_id, month, SUM(total) AS total, SUM(fine_count) AS fine_count
+            FROM monthly_totals WHERE month IN (SELECT month FROM months)
+            GROUP BY employee_id, month
+        ),
+        grid AS (
+            SELECT p.employee_id, m.month, m.n,
+                   COALESCE(pm.total, 0) AS total, COALESCE(pm.fine_count, 0) AS fine_count
+            FROM (SELECT DISTINCT employee_id FROM per_month JOIN months USING (month) WHERE n <= ?) p
+            CROSS JOIN months m
+            LEFT JOIN per_month pm ON pm.employee_id = p.employee_id AND pm.month = m.month
+        ),
+        trend AS (
+            SELECT employee_id, month, n, total, fine_count,
+                   total - LAG(total) OVER w AS change,
+                   AVG(total) OVER (w ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) AS rolling
+            FROM grid
+            WINDOW w AS (PARTITION BY employee_id ORDER BY month)
+        ),
+        reasons AS (
+            SELECT mt.employee_id, mt.fine_type_id, COUNT(*) AS months, SUM(mt.fine_count) AS fines,
+                   ROW_NUMBER() OVER (PARTITION BY mt.employee_id
+                                      ORDER BY COUNT(*) DESC, SUM(mt.fine_count) DESC, mt.fine_type_id) AS place
+            FROM monthly_totals mt JOIN months m ON m.month = mt.month AND m.n <= ?
+            GROUP BY mt.employee_id, mt.fine_type_id
+        ),
+        top AS (
+            SELECT r.employee_id, json_group_array(json_array(r.place, t.reason, r.months, r.fines)) AS reasons
+            FROM reasons r JOIN fine_types t ON t.id = r.fine_type_id
+            WHERE r.place <= ?
+            GROUP BY r.employee_id
+        )
+        SELECT e.name, tr.month, tr.total, tr.fine_count, tr.change, tr.rolling, top.reasons
+        FROM trend tr
+        JOIN employees e ON e.id = tr.employee_id
+        LEFT JOIN top ON top.employee_id = tr.employee_id
+        WHERE tr.n <= ?
+        ORDER BY e.name, tr.month
+    ''', (months + 2, months, months, top_reasons, months))
+
+    trends = {}
+    for employee, month, total, count, change, rolling, reasons in rows:
+        if employee not in trends:
+            # Порядок элементов json_group_array не гарантирован — сортируем по месту
+            top = sorted(json.loads(reasons or '[]'))
+            trends[employee] = ([], [tuple(reason[1:]) for reason in top])
+        trends[employee][0].append((month, total, count, change, rolling))
+    return trends
+
+# ============= ЭКСПОРТ =============
+
+EXPORT_HEADER = ('Месяц', 'Дата', 'Сотрудник', 'Нарушение', 'Баллы', 'ID')
+
+# Больше этого Telegram не принимает документы от ботов
+EXPORT_MAX_BYTES = 50 * 1024 * 1024
+
+def iter_month_fines(month):
+    """Строки выгрузки за месяц в порядке EXPORT_HEADER. Генератор читает
+    курсор по мере записи файла и не держит месяц в памяти. Строки закрытого
+    месяца читаются из его архива"""
+    archive_file = db.fetch_value('SELECT archive_file FROM closed_months WHERE month=?', (month,))
+    if archive_file:
+        yield from read_csv_gz(os.path.join(archive_dir(), archive_file))
+        return
+    start, end = month_bounds(month)
+    cursor = db.get_connection().execute('''
+        SELECT f.created_at, e.name, t.reason, t.amount, f.id
+        FROM employees e
+        JOIN fines f ON f.employee_id = e.id AND f.created_at >= ? AND f.created_at < ?
+        JOIN fine_types t ON t.id = f.fine_type_id
+        ORDER BY e.id, f.created_at, f.id
+    ''', (start, end))
+    for created_at, employee, reason, amount, fine_id in cursor:
+        yield month, format_timestamp(created_at), employee, reason, amount, fine_id
+
+def iter_all_months():
+    """Все месяцы из get_available_months, от новых к старым, по страницам"""
+    cursor = None
+    while True:
+        months, has_prev, has_next = get_available_months(cursor)
+        yield from months
+        if not has_next:
+            return
+        cursor = months[-1]
+
+def export_fines(month=None, fmt='csv'):
+    """Пишет штрафы за месяц (или за все месяцы) в файл формата fmt.
+    Возвращает (файл, имя файла, количество строк). Выполняется в потоке чтения БД"""
+    months = [month] if month else iter_all_months()
+    rows = (row for each in months for row in iter_month_fines(each))
+    spool, count = WRITERS[fmt](EXPORT_HEADER, rows)
+    return spool, f"fines_{month or 'all'}.{fmt}", count
+
+# ============= ЗАКРЫТИЕ МЕСЯЦЕВ =============
+# Закрытый месяц «заморожен»: его итоги остаются в monthly_totals (экраны
+# архива читают только их), а строки fines переносятся в сжатый CSV.
+# Так в горячей таблице fines остаются только незакрытые месяцы
+
+# Каталог архивов; по умолчанию archive/ рядом с базой
+FINES_ARCHIVE_DIR = os.environ.get('FINES_ARCHIVE_DIR')
+
+def archive_dir():
+    return FINES_ARCHIVE_DIR or os.path.join(os.path.dirname(os.path.abspath(db.DB_PATH)), 'archive')
+
+def get_closed_months():
+    """Закрытые месяцы: их строки перенесены в архив, в боте остались только итоги"""
+    return [row[0] for row in db.fetch_all('SELECT month FROM closed_months ORDER BY month')]
+
+def close_month(month, vacuum=True):
+    """Закрывает закончившийся месяц: пишет его строки в archive/fines_YYYY-MM.csv.gz,
+    удаляет их из fines и fines_fts и записывает месяц в closed_months. Возвращает число строк"""
+    month = parse_month(month)
+    if month >= get_current_month():
+        raise ValueError(f"Месяц {month} ещё не закончился")
+    if db.fetch_value('SELECT 1 FROM closed_months WHERE month=?', (month,)):
+        raise ValueError(f"Месяц {month} уже закрыт")
+    start, end = month_bounds(month)
+    archive_file = f"fines_{month}.csv.gz"
+    os.makedirs(archive_dir(), exist_ok=True)
     
-    if is_admin(user_id):
-        # Меню для администратора
-        keyboard = [
-            [InlineKeyboardButton("📝 Добавить штраф", callback_data="add_fine")],
-            [InlineKeyboardButton("📊 Текущий месяц", callback_data="check_fines")],
-            [InlineKeyboardButton("📅 Архив месяцев", callback_data="show_months")],
-            [InlineKeyboardButton("✏️ Корректировка штрафов", callback_data="adjust_fines")]
-        ]
-    else:
-        # Меню для обычного пользователя
-        keyboard = [
-            [InlineKeyboardButton("📊 Текущий месяц", callback_data="check_fines")],
-            [InlineKeyboardButton("📅 Архив месяцев", callback_data="show_months")]
-        ]
+    # Архив пишется до транзакции, чтобы не держать блокировку записи всё это время.
+    # Если строки месяца успели измениться, счётчики не сойдутся и месяц останется открытым
+    archived = write_csv_gz(os.path.join(archive_dir(), archive_file), EXPORT_HEADER,
+                            iter_month_fines(month))
+    with db.transaction() as conn:
+        _unindex_fines(conn, 'f.employee_id IN (SELECT id FROM employees) AND f.created_at >= ? AND f.created_at < ?',
+                       (start, end))
+        deleted = conn.execute('''
+            DELETE FROM fines 
+            WHERE employee_id IN (SELECT id FROM employees) AND created_at >= ? AND created_at < ?
+        ''', (start, end)).rowcount
+        if deleted != archived:
+            raise RuntimeError(f"В архив {month} записано {archived} строк, а в fines их {deleted}")
+        conn.execute('''
+            INSERT INTO closed_months (month, closed_at, fine_count, total, archive_file) 
+            SELECT ?, ?, COALESCE(SUM(fine_count), 0), COALESCE(SUM(total), 0), ? 
+            FROM monthly_totals WHERE month=?
+        ''', (month, int(time.time()), archive_file, month))
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if vacuum:
+        compact_database()
+    return archived
+
+def close_finished_months():
+    """Закрывает все закончившиеся месяцы, VACUUM — один раз в конце.
+    Возвращает список (месяц, перенесено строк)"""
+    months = [row[0] for row in db.fetch_all('''
+        SELECT DISTINCT month FROM monthly_totals 
+        WHERE month < ? AND month NOT IN (SELECT month FROM closed_months) 
+        ORDER BY month
+    ''', (get_current_month(),))]
+    closed = [(month, close_month(month, vacuum=False)) for month in months]
+    if closed:
+        compact_database()
+    return closed
+
+def compact_database():
+    """Сливает сегменты fines_fts и сжимает файл базы. После массового удаления
+    индекс хранит метки удалённых строк, и без слияния поиск замедляется в разы"""
+    conn = db.get_connection()
+    conn.execute("INSERT INTO fines_fts (fines_fts) VALUES ('optimize')")
+    conn.execute('VACUUM')
+
+# ============= ПОИСК =============
+# fines_fts индексирует имя сотрудника и причину каждого штрафа в fines и
+# обновляется в тех же транзакциях, что и fines. Закрытые месяцы из fines
+# удалены, поэтому ищутся только незакрытые
+
+SEARCH_PAGE_SIZE = 10
+
+def get_search_vocabulary():
+    """Термы индекса поиска: fines_fts индексирует только имена сотрудников и причины,
+    поэтому словарь — это их слова. Строится в refresh_catalog и живёт в памяти"""
+    return _search_vocabulary
+
+def search_fines(text, page=0, limit=SEARCH_PAGE_SIZE):
+    """Ищет штрафы по словам из имени и причины, с периодом «ГГГГ-ММ[-ДД][..ГГГГ-ММ[-ДД]]».
+    Слово ищется по префиксу, а если таких термов нет — по похожим (опечатка).
+    Возвращает (строки, есть следующая страница); строки (id, время, сотрудник,
+    причина, сумма) — сначала лучшие совпадения, при равенстве новые.
+    ValueError — неверная дата в запросе"""
+    words, start, end = parse_query(text)
+    match = build_match(words, get_search_vocabulary())
+    if match is None:
+        return [], False
+    # Ранг bm25 не годится в курсор, поэтому страницы — через OFFSET
+    rows = db.fetch_all('''
+        SELECT f.id, f.created_at, e.name, t.reason, t.amount
+        FROM fines_fts s
+        JOIN fines f ON f.id = s.rowid
+        JOIN employees e ON e.id = f.employee_id
+        JOIN fine_types t ON t.id = f.fine_type_id
+        WHERE fines_fts MATCH ? AND f.created_at >= ? AND f.created_at < ?
+        ORDER BY s.rank, f.created_at DESC, f.id DESC
+        LIMIT ? OFFSET ?
+    ''', (match, start or 0, end or sys.maxsize, limit + 1, page * limit))
+    return rows[:limit], len(rows) > limit
+
+def rebuild_search_index():
+    """Заново строит fines_fts по fines (после загрузки строк в обход хелперов)"""
+    with db.transaction() as conn:
+        conn.execute("INSERT INTO fines_fts (fines_fts) VALUES ('rebuild')")
+
+# ============= ПЕРЕСЧЁТ ИТОГОВ =============
+
+_TOTALS_FROM_FINES = '''
+    SELECT strftime('%Y-%m', f.created_at, 'unixepoch', 'localtime'), f.employee_id, f.fine_type_id,
+           COUNT(*), SUM(t.amount), MAX(f.created_at)
+    FROM fines f JOIN fine_types t ON t.id = f.fine_type_id
+    GROUP BY 1, 2, 3
+'''
+
+def rebuild_monthly_totals():
+    """Пересчитывает monthly_totals по исходным строкам fines. Итоги закрытых
+    месяцев не трогает: их строк в fines уже нет"""
+    with db.transaction() as conn:
+        conn.execute('DELETE FROM monthly_totals WHERE month NOT IN (SELECT month FROM closed_months)')
+        conn.execute('INSERT INTO monthly_totals (month, employee_id, fine_type_id, fine_count, total, last_at) '
+                     + _TOTALS_FROM_FINES)
+    render_cache.clear()
+
+def verify_monthly_totals():
+    """Сравнивает monthly_totals с пересчётом по fines. Возвращает расхождения
+    в виде списка (источник, month, employee_id, fine_type_id, количество, сумма, время)"""
+    columns = 'month, employee_id, fine_type_id, fine_count, total, last_at'
+    missing = db.fetch_all(f'{_TOTALS_FROM_FINES} EXCEPT SELECT {columns} FROM monthly_totals')
+    extra = db.fetch_all(f'''
+        SELECT {columns} FROM monthly_totals WHERE month NOT IN (SELECT month FROM closed_months) 
+        EXCEPT {_TOTALS_FROM_FINES}
+    ''')
+    return [('fines',) + row for row in missing] + [('monthly_totals',) + row for row in extra]
+
+class _Rollback(Exception):
+    pass
+
+# Запросы FTS5 к своим служебным таблицам: SELECT k, v FROM 'main'.'fines_fts_config' и т.п.
+FTS_SHADOW_TABLE = re.compile(r"'fines_fts_(?:config|data|idx|docsize|content)'")
+
+def check_query_plans():
+    """Проверяет через EXPLAIN QUERY PLAN, что запросы всех хелперов идут по индексам"""
+    init_db()
+    month = get_current_month()
+    employee = EMPLOYEES[0]
+    helpers = [
+        (get_employee_total, (employee,)),
+        (get_employee_total_and_count, (employee,)),
+        (get_employee_fines_list, (employee,)),
+        (get_employee_fines_list, (employee, 1)),
+        (get_employee_fines_list, (employee, 1, True)),
+        (get_employee_fines_summary, (employee,)),
+        (get_employee_fines_summary_by_month, (employee, month)),
+        (get_month_snapshot, (month,)),
+        (get_month_ranking, (month,)),
+        (get_month_ranking, (month, (15, employee))),
+        (get_month_ranking, (month, (15, employee), True)),
+        (get_available_months, ()),
+        (get_available_months, (month,)),
+        (get_available_months, (month, True)),
+        (get_fine, (1,)),
+        (add_fine, (employee, 15, FINES[15][0])),
+        (add_fines, ([(employee, 15, FINES[15][0]), (EMPLOYEES[1], 15, FINES[15][0])],)),
+        (remove_last_fine, (employee,)),
+        (delete_specific_fine, (0,)),
+        (search_fines, (FINES[15][0],)),
+        (search_fines, (f"{employee} {month}", 1)),
+    ]
+    # Пишущие хелперы выполняются внутри транзакции, которая затем откатывается
+    try:
+        with db.transaction():
+            for func, args in helpers:
+                for sql in db.capture_queries(func, *args):
+                    # Служебные таблицы FTS5 (fines_fts_config, _data, _idx...) движок читает сам
+                    if FTS_SHADOW_TABLE.search(sql):
+                        continue
+                    if sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                        db.assert_uses_index(sql)
+                print(f"✅ {func.__name__}: запросы используют индексы")
+            raise _Rollback
+    except _Rollback:
+        pass
+
+# ============================================================
+
+async def main_menu(update_or_query, context: ContextTypes.DEFAULT_TYPE, text="Главное меню:", is_admin_user=False):
+    """Показывает главное меню с учетом прав пользователя"""
+    # Меню для администратора или обычного пользователя
+    reply_markup = ADMIN_MENU_KEYBOARD if is_admin_user else USER_MENU_KEYBOARD
     
     if hasattr(update_or_query, 'message'):
         await update_or_query.message.reply_text(text, reply_markup=reply_markup)
     else:
         await update_or_query.edit_message_text(text, reply_markup=reply_markup)
 
+@contextmanager
+def handling(route, user_id):
+    """Время обработки обновления: в HANDLER_LATENCY и в лог с полями user_id, route, duration_ms"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        HANDLER_LATENCY.observe(duration, route)
+        logger.info("Обновление обработано", extra=log_fields(
+            'update', user_id=user_id, route=route, duration_ms=round(duration * 1000, 1)))
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with handling("start", update.effective_user.id):
+        await _start(update, context)
+
+async def _start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     username = update.effective_user.username or "без username"
+    is_admin_user = is_admin(user_id)
     
-    logger.info(f"Пользователь {user_id} (@{username}) запустил бота")
-    
-    # ДИАГНОСТИКА
-    print(f"START: user_id={user_id}, username={username}")
-    print(f"START: ADMIN_IDS={ADMIN_IDS}")
-    print(f"START: is_admin={is_admin(user_id)}")
+    logger.info("Пользователь запустил бота",
+                extra=log_fields('start', user_id=user_id, username=username, is_admin=is_admin_user))
     
-    if is_admin(user_id):
-        await main_menu(update, context, f"👋 Добро пожаловать, администратор @{username}!")
+    if is_admin_user:
+        await main_menu(update, context, f"👋 Добро пожаловать, администратор @{username}!", is_admin_user)
     else:
-        await main_menu(update, context, f"👋 Добро пожаловать, @{username}!\n\nВы можете просматривать штрафы.")
+        await main_menu(update, context, f"👋 Добро пожаловать, @{username}!\n\nВы можете просматривать штрафы.", is_admin_user)
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    
-    # ДИАГНОСТИКА
-    print(f"🔍 CALLBACK: data='{query.data}'")
-    print(f"🔍 is_admin_user={is_admin(query.from_user.id)}")
-    
-    user_id = query.from_user.id
-    is_admin_user = is_admin(user_id)
+async def cached_render(key, month, render, *args):
+    """Берёт экран из render_cache или строит его через render(*args).
+    Кэш сбрасывается записями в месяц (см. add_fine / delete_specific_fine)"""
+    cached = render_cache.get(key)
+    if cached is None:
+        generation = render_cache.generation(month)
+        cached = await render(*args)
+        render_cache.put(key, month, cached, generation)
+    return cached
+
+def page_buttons(route, args, has_prev, has_next, first_key, last_key):
+    """Ряд кнопок листания. Курсоры — ключи первой и последней строки страницы;
+    args — аргументы маршрута перед направлением и курсором"""
+    row = []
+    if has_prev:
+        row.append(InlineKeyboardButton("⬅️ Предыдущие", callback_data=router.data(route, *args, PAGE_BACKWARD, *first_key)))
+    if has_next:
+        row.append(InlineKeyboardButton("Следующие ➡️", callback_data=router.data(route, *args, PAGE_FORWARD, *last_key)))
+    return [row] if row else []
+
+def parse_employee(raw):
+    """Восстанавливает оригинальное имя сотрудника из callback_data"""
+    return (EMPLOYEE_BY_CALLBACK.get(raw) or raw.replace('_', ' '),)
+
+def parse_fine_index(raw):
+    """fine_{индекс в FINE_CATALOG} старого формата -> id нарушения в fine_types"""
+    fine_index = int(raw)
+    if not 0 <= fine_index < len(FINE_CATALOG):
+        raise IndexError(fine_index)
+    return (FINE_TYPE_IDS[FINE_CATALOG[fine_index]],)
+
+def parse_month_employee(raw):
+    """month_emp_{YYYY-MM}_{safe_emp} -> (месяц, сотрудник)"""
+    month, employee_raw = raw.split('_', 1)
+    return (month,) + parse_employee(employee_raw)
+
+@router.route("main_menu")
+async def show_main_menu(query, context, is_admin_user):
+    await main_menu(query, context, is_admin_user=is_admin_user)
+
+@router.route("add_fine", admin_only=True)
+async def choose_employee_for_fine(query, context, is_admin_user):
+    # Шаг 1: Выбор сотрудника
+    await query.edit_message_text(
+        "👥 Выберите сотрудника:",
+        reply_markup=EMPLOYEE_KEYBOARD
+    )
+
+@router.route("emp_fine_", admin_only=True, parse=parse_employee)
+async def choose_fine_for_employee(query, context, is_admin_user, employee):
+    # Шаг 2: Выбор нарушения
+    context.user_data['employee'] = employee
     
-    # Проверяем права доступа для административных функций
-    if not is_admin_user and query.data not in ["check_fines", "main_menu", "no_action", "back_to_fines_list", "show_months"]:
+    await query.edit_message_text(
+        f"👤 Сотрудник: {employee}\n\n"
+        f"📋 Выберите нарушение:",
+        reply_markup=FINE_KEYBOARD
+    )
+
+@router.route("fine_", admin_only=True, parse=parse_fine_index)
+async def add_fine_by_id(query, context, is_admin_user, fine_id):
+    # Шаг 3: Добавление штрафа по ID нарушения
+    amount, reason = FINE_BY_ID[fine_id]
+    employee = context.user_data.get('employee')
+    if not employee:
+        # Выбор сотрудника потерян (например, кнопка из сообщения до перезапуска) — начинаем заново
         await query.edit_message_text(
-            "⛔ У вас нет прав для выполнения этого действия.\n\n"
-            "Только администраторы могут добавлять и корректировать штрафы.",
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("◀️ В главное меню", callback_data="main_menu")
-            ]])
+            "⚠️ Сотрудник не выбран, штраф не добавлен.\n\n👥 Выберите сотрудника:",
+            reply_markup=EMPLOYEE_KEYBOARD
         )
         return
     
-    if query.data == "main_menu":
-        await main_menu(query, context)
+    await db.write(add_fine, employee, amount, reason)
     
-    elif query.data == "add_fine" and is_admin_user:
-        # Шаг 1: Выбор сотрудника
-        keyboard = []
-        for emp in EMPLOYEES:
-            safe_emp = safe_callback(emp)
-            keyboard.append([InlineKeyboardButton(emp, callback_data=f"emp_fine_{safe_emp}")])
-        keyboard.append([InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")])
-        
+    new_total = await db.read(get_employee_total, employee)
+    
+    await query.edit_message_text(
+        f"✅ Штраф успешно добавлен!\n\n"
+        f"👤 Сотрудник: {employee}\n"
+        f"💰 Штраф: {amount} баллов\n"
+        f"📋 Причина: {reason}\n"
+        f"📅 Месяц: {get_current_month()}\n"
+        f"💯 Всего у сотрудника: {new_total} баллов",
+        reply_markup=AFTER_FINE_KEYBOARD
+    )
+
+# ============= ГРУППОВОЙ ШТРАФ =============
+# Выбор хранится в context.user_data['batch']: обновления одного пользователя
+# обрабатываются по очереди (PerUserUpdateProcessor), поэтому гонок нет.
+# Нарушения хранятся как fine_types.id; выбор старого формата (индексы
+# каталога под ключом 'fines', сохранённый до перезапуска) сбрасывается
+
+def _empty_batch():
+    return {'employees': [], 'fine_type_ids': []}
+
+def _batch_selection(context):
+    selection = context.user_data.get('batch')
+    if selection is None or 'fine_type_ids' not in selection:
+        selection = context.user_data['batch'] = _empty_batch()
+    return selection
+
+def _toggle(items, value):
+    if value in items:
+        items.remove(value)
+    else:
+        items.append(value)
+
+def _batch_summary(selection):
+    return (f"👥 Сотрудников выбрано: {len(selection['employees'])}\n"
+            f"📋 Нарушений выбрано: {len(selection['fine_type_ids'])}")
+
+async def _show_batch_employees(query, selection):
+    keyboard = [[InlineKeyboardButton(f"{'✅' if emp in selection['employees'] else '▫️'} {emp}",
+                                      callback_data=router.data("batch_emp_", emp))]
+                for emp in EMPLOYEES]
+    keyboard.append([InlineKeyboardButton("Далее: нарушения ➡️", callback_data="batch_fines")])
+    keyboard.append([MAIN_MENU_BUTTON])
+    await query.edit_message_text(
+        f"👥 Групповой штраф\n\n{_batch_summary(selection)}\n\n"
+        f"Отметьте сотрудников:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def _show_batch_fines(query, selection):
+    keyboard = [[InlineKeyboardButton(f"{'✅' if FINE_TYPE_IDS[amount, reason] in selection['fine_type_ids'] else '▫️'} "
+                                      f"{reason} ({amount} баллов)",
+                                      callback_data=router.data("batch_type_", FINE_TYPE_IDS[amount, reason]))]
+                for amount, reason in FINE_CATALOG]
+    count = len(selection['employees']) * len(selection['fine_type_ids'])
+    if count:
+        keyboard.append([InlineKeyboardButton(f"✅ Подтвердить ({count} штраф(ов))", callback_data="batch_confirm")])
+    keyboard.append([InlineKeyboardButton("◀️ Назад к сотрудникам", callback_data="batch_employees")])
+    keyboard.append([MAIN_MENU_BUTTON])
+    await query.edit_message_text(
+        f"👥 Групповой штраф\n\n{_batch_summary(selection)}\n\n"
+        f"Отметьте нарушения — каждое будет выписано каждому выбранному сотруднику:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+@router.route("batch_fine", admin_only=True)
+async def start_batch_fine(query, context, is_admin_user):
+    context.user_data.pop('batch', None)
+    await _show_batch_employees(query, _batch_selection(context))
+
+@router.route("batch_employees", admin_only=True)
+async def show_batch_employees(query, context, is_admin_user):
+    await _show_batch_employees(query, _batch_selection(context))
+
+@router.route("batch_emp_", admin_only=True, parse=parse_employee)
+async def toggle_batch_employee(query, context, is_admin_user, employee):
+    selection = _batch_selection(context)
+    _toggle(selection['employees'], employee)
+    await _show_batch_employees(query, selection)
+
+@router.route("batch_fines", admin_only=True)
+async def show_batch_fines(query, context, is_admin_user):
+    await _show_batch_fines(query, _batch_selection(context))
+
+@router.route("batch_type_", admin_only=True, parse=parse_fine_index)
+async def toggle_batch_fine(query, context, is_admin_user, fine_id):
+    selection = _batch_selection(context)
+    _toggle(selection['fine_type_ids'], fine_id)
+    await _show_batch_fines(query, selection)
+
+@router.route("batch_confirm", admin_only=True)
+async def confirm_batch_fine(query, context, is_admin_user):
+    # Выбор забираем сразу: повторное нажатие не добавит штрафы второй раз
+    selection = context.user_data.pop('batch', None)
+    if selection is None or 'fine_type_ids' not in selection:
+        selection = _empty_batch()
+    catalog = [FINE_BY_ID[fine_id] for fine_id in selection['fine_type_ids'] if fine_id in FINE_BY_ID]
+    fines = [(emp, amount, reason) for emp in selection['employees'] for amount, reason in catalog]
+    
+    if not fines:
         await query.edit_message_text(
-            "👥 Выберите сотрудника:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            "❌ Ничего не выбрано — штрафы не добавлены",
+            reply_markup=AFTER_FINE_KEYBOARD
         )
+        return
     
-    elif query.data.startswith("emp_fine_") and is_admin_user:
-        # Шаг 2: Выбор нарушения
-        employee_raw = query.data[9:]
-        
-        # Восстанавливаем оригинальное имя
-        employee = None
-        for emp in EMPLOYEES:
-            if safe_callback(emp) == employee_raw:
-                employee = emp
-                break
-        
-        if not employee:
-            employee = employee_raw.replace('_', ' ')
-        
-        context.user_data['employee'] = employee
-        
-        # Собираем все нарушения в один список с индексами
-        keyboard = []
-        fine_index = 0
-        for amount, reasons in FINES.items():
-            for reason in reasons:
-                keyboard.append([InlineKeyboardButton(
-                    f"{reason} ({amount} баллов)", 
-                    callback_data=f"fine_{fine_index}"
-                )])
-                fine_index += 1
-        
-        keyboard.append([InlineKeyboardButton("◀️ Назад к сотрудникам", callback_data="add_fine")])
-        keyboard.append([InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")])
-        
+    added = await db.write(add_fines, fines)
+    totals = dict((emp, total) for emp, total, count, last_at in await db.read(get_month_snapshot))
+    
+    text = f"✅ Добавлено штрафов: {added}\n"
+    text += f"📅 Месяц: {get_current_month()}\n\n"
+    text += "📋 Нарушения:\n"
+    for amount, reason in catalog:
+        text += f"   • {reason} ({amount} баллов)\n"
+    text += "\n👥 Всего у сотрудников:\n"
+    for emp in selection['employees']:
+        text += f"   • {emp}: {totals.get(emp, 0)} баллов\n"
+    
+    await query.edit_message_text(text, reply_markup=AFTER_FINE_KEYBOARD)
+
+@router.route("adjust_fines", admin_only=True)
+async def show_adjust_list(query, context, is_admin_user):
+    # Получаем список сотрудников, у которых есть штрафы
+    snapshot = await db.read(get_month_snapshot)
+    
+    if not snapshot:
         await query.edit_message_text(
-            f"👤 Сотрудник: {employee}\n\n"
-            f"📋 Выберите нарушение:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            "✏️ Корректировка штрафов\n\n"
+            "❌ Нет сотрудников со штрафами в текущем месяце",
+            reply_markup=MAIN_MENU_KEYBOARD
         )
+        return
     
-    elif query.data.startswith("fine_") and is_admin_user:
-        # Шаг 3: Добавление штрафа по индексу
-        fine_index = int(query.data[5:])
-        
-        # Находим нарушение по индексу
-        all_fines = []
-        for amount, reasons in FINES.items():
-            for reason in reasons:
-                all_fines.append((amount, reason))
-        
-        amount, reason = all_fines[fine_index]
-        employee = context.user_data.get('employee', '')
-        
-        add_fine(employee, amount, reason)
+    # Показываем список всех сотрудников со штрафами
+    keyboard = []
+    for emp, total, count, last_at in snapshot:
+        keyboard.append([InlineKeyboardButton(
+            f"{emp} (👤 {total} баллов)", 
+            callback_data=router.data("adjust_emp_", emp)
+        )])
+    
+    keyboard.append([MAIN_MENU_BUTTON])
+    
+    await query.edit_message_text(
+        "✏️ Корректировка штрафов\n\n"
+        "Выберите сотрудника для корректировки:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+@router.route("adjust_emp_", admin_only=True)
+@router.route("adjust_page_", admin_only=True)
+async def show_adjust_employee(query, context, is_admin_user, employee, direction=PAGE_FORWARD, fine_id=None):
+    context.user_data['adjust_employee'] = employee
+    
+    fines_list, has_prev, has_next = await db.read(get_employee_fines_list, employee, fine_id,
+                                                   direction == PAGE_BACKWARD)
+    total, count = await db.read(get_employee_total_and_count, employee)
+    
+    keyboard = []
+    
+    # Добавляем кнопки для каждого штрафа
+    for fine_id, amount, reason, created_at in fines_list:
+        date_short = format_timestamp(created_at, "%Y-%m-%d")
+        short_reason = reason if len(reason) <= 25 else reason[:22] + "..."
+        keyboard.append([
+            InlineKeyboardButton(
+                f"🗑 {amount} баллов - {short_reason} ({date_short})", 
+                callback_data=router.data("delete_fine_", fine_id)
+            )
+        ])
+    
+    if fines_list:
+        keyboard += page_buttons("adjust_page_", (employee,), has_prev, has_next,
+                                 (fines_list[0][0],), (fines_list[-1][0],))
+    
+    # Кнопка для удаления последнего штрафа
+    if fines_list:
+        keyboard.append([InlineKeyboardButton("⏪ Удалить последний штраф", callback_data=router.data("delete_last_", employee))])
+    
+    keyboard.append([InlineKeyboardButton("◀️ Назад к списку сотрудников", callback_data="adjust_fines")])
+    keyboard.append([MAIN_MENU_BUTTON])
+    
+    await query.edit_message_text(
+        f"✏️ Корректировка штрафов: {employee}\n"
+        f"💰 Текущая сумма: {total} баллов\n"
+        f"📋 Количество штрафов: {count}\n\n"
+        f"Выберите штраф для удаления:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+@router.route("delete_last_", admin_only=True)
+async def delete_last_fine(query, context, is_admin_user, employee):
+    last_fine = await db.write(remove_last_fine, employee)
+    
+    if last_fine:
+        fine_id, amount, reason = last_fine
+        new_total = await db.read(get_employee_total, employee)
         
         keyboard = [
-            [InlineKeyboardButton("📝 Добавить ещё штраф", callback_data="add_fine")],
-            [InlineKeyboardButton("✏️ Корректировка штрафов", callback_data="adjust_fines")],
-            [InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")]
+            [InlineKeyboardButton("✏️ Продолжить корректировку", callback_data=router.data("adjust_emp_", employee))],
+            [MAIN_MENU_BUTTON]
         ]
         
-        new_total = get_employee_total(employee)
-        
         await query.edit_message_text(
-            f"✅ Штраф успешно добавлен!\n\n"
+            f"✅ Последний штраф удален!\n\n"
             f"👤 Сотрудник: {employee}\n"
-            f"💰 Штраф: {amount} баллов\n"
+            f"💰 Удалено: {amount} баллов\n"
             f"📋 Причина: {reason}\n"
-            f"📅 Месяц: {get_current_month()}\n"
-            f"💯 Всего у сотрудника: {new_total} баллов",
+            f"💯 Новая сумма: {new_total} баллов",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
-    
-    elif query.data == "adjust_fines" and is_admin_user:
-        # Получаем список сотрудников, у которых есть штрафы
-        employees_with_fines = get_all_employees_with_fines()
-        
-        if not employees_with_fines:
-            keyboard = [[InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")]]
-            await query.edit_message_text(
-                "✏️ Корректировка штрафов\n\n"
-                "❌ Нет сотрудников со штрафами в текущем месяце",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        
-        # Показываем список всех сотрудников со штрафами
-        keyboard = []
-        for emp in employees_with_fines:
-            total = get_employee_total(emp)
-            keyboard.append([InlineKeyboardButton(
-                f"{emp} (👤 {total} баллов)", 
-                callback_data=f"adjust_emp_{emp}"
-            )])
-        
-        keyboard.append([InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")])
+    else:
+        keyboard = [
+            [InlineKeyboardButton("◀️ Назад", callback_data=router.data("adjust_emp_", employee))],
+            [MAIN_MENU_BUTTON]
+        ]
         
         await query.edit_message_text(
-            "✏️ Корректировка штрафов\n\n"
-            "Выберите сотрудника для корректировки:",
+            f"❌ У сотрудника {employee} нет штрафов для удаления",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
+
+@router.route("delete_fine_", admin_only=True, parse=lambda raw: (int(raw),))
+async def delete_fine_by_id(query, context, is_admin_user, fine_id):
+    fine_info = await db.read(get_fine, fine_id)
     
-    elif query.data.startswith("adjust_emp_") and is_admin_user:
-        employee = query.data[11:]
-        context.user_data['adjust_employee'] = employee
-        
-        fines_list = get_employee_fines_list(employee)
-        total = get_employee_total(employee)
+    if fine_info:
+        employee, amount, reason = fine_info
+        await db.write(delete_specific_fine, fine_id)
+        new_total = await db.read(get_employee_total, employee)
         
-        keyboard = []
-        
-        # Добавляем кнопки для каждого штрафа
-        for fine_id, amount, reason, date in fines_list:
-            date_short = date.split()[0]
-            short_reason = reason if len(reason) <= 25 else reason[:22] + "..."
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"🗑 {amount} баллов - {short_reason} ({date_short})", 
-                    callback_data=f"delete_fine_{fine_id}"
-                )
-            ])
-        
-        # Кнопка для удаления последнего штрафа
-        if fines_list:
-            keyboard.append([InlineKeyboardButton("⏪ Удалить последний штраф", callback_data=f"delete_last_{employee}")])
-        
-        keyboard.append([InlineKeyboardButton("◀️ Назад к списку сотрудников", callback_data="adjust_fines")])
-        keyboard.append([InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")])
+        keyboard = [
+            [InlineKeyboardButton("✏️ Продолжить корректировку", callback_data=router.data("adjust_emp_", employee))],
+            [MAIN_MENU_BUTTON]
+        ]
         
         await query.edit_message_text(
-            f"✏️ Корректировка штрафов: {employee}\n"
-            f"💰 Текущая сумма: {total} баллов\n"
-            f"📋 Количество штрафов: {len(fines_list)}\n\n"
-            f"Выберите штраф для удаления:",
+            f"✅ Штраф удален!\n\n"
+            f"👤 Сотрудник: {employee}\n"
+            f"💰 Удалено: {amount} баллов\n"
+            f"📋 Причина: {reason}\n"
+            f"💯 Новая сумма: {new_total} баллов",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
+    else:
+        await query.edit_message_text(
+            f"❌ Штраф не найден или уже был удален",
+            reply_markup=MAIN_MENU_KEYBOARD
+        )
+
+# ============= ОБНОВЛЕННЫЙ ОБРАБОТЧИК check_fines =============
+@router.route("check_fines")
+async def show_current_month(query, context, is_admin_user):
+    # Получаем список сотрудников со штрафами за текущий месяц
+    current = get_current_month()
+    snapshot = await db.read(get_month_snapshot, current)
     
-    elif query.data.startswith("delete_last_") and is_admin_user:
-        employee = query.data[12:]
+    if not snapshot:
+        text = f"📊 Текущий месяц ({current})\n\n"
+        text += "За текущий месяц штрафов нет."
         
-        last_fine = remove_last_fine(employee)
+        # Для админов добавляем кнопку добавления
+        keyboard = EMPTY_MONTH_ADMIN_KEYBOARD if is_admin_user else MAIN_MENU_KEYBOARD
         
-        if last_fine:
-            fine_id, amount, reason = last_fine
-            new_total = get_employee_total(employee)
-            
-            keyboard = [
-                [InlineKeyboardButton("✏️ Продолжить корректировку", callback_data=f"adjust_emp_{employee}")],
-                [InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")]
-            ]
-            
-            await query.edit_message_text(
-                f"✅ Последний штраф удален!\n\n"
-                f"👤 Сотрудник: {employee}\n"
-                f"💰 Удалено: {amount} баллов\n"
-                f"📋 Причина: {reason}\n"
-                f"💯 Новая сумма: {new_total} баллов",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-        else:
-            keyboard = [
-                [InlineKeyboardButton("◀️ Назад", callback_data=f"adjust_emp_{employee}")],
-                [InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")]
-            ]
-            
-            await query.edit_message_text(
-                f"❌ У сотрудника {employee} нет штрафов для удаления",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+        await query.edit_message_text(text, reply_markup=keyboard)
+        return
     
-    elif query.data.startswith("delete_fine_") and is_admin_user:
-        fine_id = int(query.data[12:])
-        
-        conn = sqlite3.connect('fines.db')
-        c = conn.cursor()
-        c.execute('SELECT employee, amount, reason FROM fines WHERE id=?', (fine_id,))
-        fine_info = c.fetchone()
-        conn.close()
-        
-        if fine_info:
-            employee, amount, reason = fine_info
-            delete_specific_fine(fine_id)
-            new_total = get_employee_total(employee)
-            
-            keyboard = [
-                [InlineKeyboardButton("✏️ Продолжить корректировку", callback_data=f"adjust_emp_{employee}")],
-                [InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")]
-            ]
-            
-            await query.edit_message_text(
-                f"✅ Штраф удален!\n\n"
-                f"👤 Сотрудник: {employee}\n"
-                f"💰 Удалено: {amount} баллов\n"
-                f"📋 Причина: {reason}\n"
-                f"💯 Новая сумма: {new_total} баллов",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-        else:
-            await query.edit_message_text(
-                f"❌ Штраф не найден или уже был удален",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")
-                ]])
-            )
+    # Форматируем название месяца
+    month_name, year = format_month(current)
     
-    # ============= ОБНОВЛЕННЫЙ ОБРАБОТЧИК check_fines =============
-    elif query.data == "check_fines":
-        # Получаем список сотрудников со штрафами за текущий месяц
-        current = get_current_month()
-        employees_with_fines = get_all_employees_with_fines()
-        
-        if not employees_with_fines:
-            text = f"📊 Текущий месяц ({current})\n\n"
-            text += "За текущий месяц штрафов нет."
-            
-            # Для админов добавляем кнопку добавления
-            if is_admin_user:
-                keyboard = [
-                    [InlineKeyboardButton("📝 Добавить штраф", callback_data="add_fine")],
-                    [InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")]
-                ]
+    # Создаем клавиатуру с сотрудниками
+    keyboard = []
+    for emp, total, count, last_at in snapshot:
+        keyboard.append([InlineKeyboardButton(
+            f"{emp} — {total} баллов", 
+            callback_data=router.data("view_employee_", emp)
+        )])
+    
+    # Добавляем навигационные кнопки
+    nav_buttons = []
+    if is_admin_user:
+        nav_buttons.append(InlineKeyboardButton("📝 Добавить штраф", callback_data="add_fine"))
+        nav_buttons.append(InlineKeyboardButton("✏️ Корректировка", callback_data="adjust_fines"))
+    
+    if nav_buttons:
+        keyboard.append(nav_buttons)
+    
+    keyboard.append([InlineKeyboardButton("📅 Архив месяцев", callback_data="show_months")])
+    keyboard.append([MAIN_MENU_BUTTON])
+    
+    await query.edit_message_text(
+        f"📊 ТЕКУЩИЙ МЕСЯЦ: {month_name.upper()} {year}\n\n"
+        f"Выберите сотрудника для просмотра детальной информации:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+# ============= ОБНОВЛЕННЫЙ ОБРАБОТЧИК view_employee_ =============
+@router.route("view_employee_")
+async def show_employee_current_month(query, context, is_admin_user, employee):
+    current = get_current_month()
+    
+    # Получаем сводку по штрафам сотрудника за текущий месяц
+    total, reasons_summary = await db.read(get_employee_fines_summary, employee)
+    
+    # Форматируем название месяца
+    month_name, year = format_month(current)
+    
+    text = f"👤 **{employee}**\n"
+    text += f"📅 {month_name} {year} (текущий месяц)\n"
+    text += f"💰 **Общая сумма штрафов: {total} баллов**\n\n"
+    
+    if reasons_summary:
+        text += "📋 **Детализация по причинам:**\n"
+        text += "═" * 25 + "\n"
+        
+        for reason, count, amount in reasons_summary:
+            if amount >= 50:
+                emoji = "🔴"
+            elif amount >= 25:
+                emoji = "🟠"
             else:
-                keyboard = [[InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")]]
+                emoji = "🟡"
             
-            await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-            return
-        
-        # Форматируем название месяца
-        year, month_num = current.split('-')
-        month_names = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
-                      "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"]
-        month_name = month_names[int(month_num) - 1]
-        
-        # Создаем клавиатуру с сотрудниками
-        keyboard = []
-        for emp in employees_with_fines:
-            total = get_employee_total(emp)
-            keyboard.append([InlineKeyboardButton(
-                f"{emp} — {total} баллов", 
-                callback_data=f"view_employee_{emp}"
-            )])
-        
-        # Добавляем навигационные кнопки
-        nav_buttons = []
-        if is_admin_user:
-            nav_buttons.append(InlineKeyboardButton("📝 Добавить штраф", callback_data="add_fine"))
-            nav_buttons.append(InlineKeyboardButton("✏️ Корректировка", callback_data="adjust_fines"))
-        
-        if nav_buttons:
-            keyboard.append(nav_buttons)
-        
-        keyboard.append([InlineKeyboardButton("📅 Архив месяцев", callback_data="show_months")])
-        keyboard.append([InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")])
+            text += f"{emoji} **{reason}**\n"
+            text += f"   └─ {count} штраф(ов) на {amount} баллов\n"
         
+        text += "═" * 25 + "\n"
+    else:
+        text += "❌ Нет штрафов за текущий месяц\n"
+    
+    # Кнопки навигации
+    keyboard = [
+        [InlineKeyboardButton("◀️ Назад к списку", callback_data="check_fines")],
+        [InlineKeyboardButton("📅 Архив месяцев", callback_data="show_months")],
+        [MAIN_MENU_BUTTON]
+    ]
+    
+    # Для админов добавляем кнопку корректировки
+    if is_admin_user:
+        keyboard.insert(0, [InlineKeyboardButton("✏️ Корректировать штрафы", callback_data=router.data("adjust_emp_", employee))])
+    
+    await query.edit_message_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='Markdown'
+    )
+
+# ============= НОВЫЙ ОБРАБОТЧИК show_months =============
+@router.route("show_months")
+@router.route("months_page_")
+async def show_months(query, context, is_admin_user, direction=PAGE_FORWARD, cursor=None):
+    # Показываем страницу доступных месяцев
+    months, has_prev, has_next = await db.read(get_available_months, cursor, direction == PAGE_BACKWARD)
+    closed = set(await db.read(get_closed_months))
+    current = get_current_month()
+    
+    if not months:
         await query.edit_message_text(
-            f"📊 ТЕКУЩИЙ МЕСЯЦ: {month_name.upper()} {year}\n\n"
-            f"Выберите сотрудника для просмотра детальной информации:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            "📅 Архив пуст\n\n"
+            "Пока нет записей о штрафах.",
+            reply_markup=MAIN_MENU_KEYBOARD
         )
+        return
     
-    # ============= ОБНОВЛЕННЫЙ ОБРАБОТЧИК view_employee_ =============
-    elif query.data.startswith("view_employee_"):
-        employee = query.data[14:]
-        current = get_current_month()
-        
-        # Получаем сводку по штрафам сотрудника за текущий месяц
-        total, reasons_summary = get_employee_fines_summary(employee)
-        
-        # Форматируем название месяца
-        year, month_num = current.split('-')
-        month_names = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
-                      "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"]
-        month_name = month_names[int(month_num) - 1]
-        
-        text = f"👤 **{employee}**\n"
-        text += f"📅 {month_name} {year} (текущий месяц)\n"
-        text += f"💰 **Общая сумма штрафов: {total} баллов**\n\n"
-        
-        if reasons_summary:
-            text += "📋 **Детализация по причинам:**\n"
-            text += "═" * 25 + "\n"
+    keyboard = []
+    for month in months:
+        # Форматируем месяц для отображения (YYYY-MM -> Месяц ГГГГ)
+        month_name, year = format_month(month)
+        display_text = f"{month_name} {year}"
+        
+        # Добавляем отметку для текущего месяца
+        if month == current:
+            display_text += " (текущий)"
+        elif month in closed:
+            # Строки закрытого месяца в архиве: видны итоги, но не отдельные штрафы
+            display_text = "🗄 " + display_text + " (закрыт)"
             
-            for reason, count, amount in reasons_summary:
-                if amount >= 50:
-                    emoji = "🔴"
-                elif amount >= 25:
-                    emoji = "🟠"
-                else:
-                    emoji = "🟡"
-                
-                text += f"{emoji} **{reason}**\n"
-                text += f"   └─ {count} штраф(ов) на {amount} баллов\n"
-            
-            text += "═" * 25 + "\n"
-        else:
-            text += "❌ Нет штрафов за текущий месяц\n"
-        
-        # Кнопки навигации
-        keyboard = [
-            [InlineKeyboardButton("◀️ Назад к списку", callback_data="check_fines")],
-            [InlineKeyboardButton("📅 Архив месяцев", callback_data="show_months")],
-            [InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")]
-        ]
-        
-        # Для админов добавляем кнопку корректировки
-        if is_admin(user_id):
-            keyboard.insert(0, [InlineKeyboardButton("✏️ Корректировать штрафы", callback_data=f"adjust_emp_{employee}")])
-        
-        await query.edit_message_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
-        )
+        keyboard.append([InlineKeyboardButton(
+            display_text,
+            callback_data=router.data("month_", month)
+        )])
     
-    # ============= НОВЫЙ ОБРАБОТЧИК show_months =============
-    elif query.data == "show_months":
-        # Показываем список доступных месяцев
-        months = get_available_months()
-        current = get_current_month()
-        
-        if not months:
-            await query.edit_message_text(
-                "📅 Архив пуст\n\n"
-                "Пока нет записей о штрафах.",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")
-                ]])
-            )
-            return
-        
-        keyboard = []
-        for month in months:
-            # Форматируем месяц для отображения (YYYY-MM -> Месяц ГГГГ)
-            year, month_num = month.split('-')
-            month_names = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
-                          "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"]
-            month_name = month_names[int(month_num) - 1]
-            display_text = f"{month_name} {year}"
+    keyboard += page_buttons("months_page_", (), has_prev, has_next, (months[0],), (months[-1],))
+    keyboard.append([MAIN_MENU_BUTTON])
+    
+    await query.edit_message_text(
+        "📅 Выберите месяц для просмотра:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+# ============= НОВЫЙ ОБРАБОТЧИК month_ =============
+async def render_month(month, backward=False, cursor=None):
+    """Страница списка сотрудников за месяц: (текст, клавиатура)"""
+    ranking, has_prev, has_next = await db.read(get_month_ranking, month, cursor, backward)
+    
+    if not ranking:
+        return (f"📊 Штрафы за {month}\n\n"
+                f"За этот месяц штрафов нет.", EMPTY_ARCHIVE_MONTH_KEYBOARD)
+    
+    # Форматируем название месяца для заголовка
+    month_name, year = format_month(month)
+    
+    text = f"📊 ШТРАФЫ ЗА {month_name.upper()} {year}\n"
+    text += "═" * 25 + "\n\n"
+    
+    # Страница уже отсортирована по сумме (от большего к меньшему)
+    keyboard = []
+    for emp, total, count, last_at in ranking:
+        text += f"👤 {emp}: {total} баллов\n"
+        # Добавляем кнопку для просмотра деталей
+        keyboard.append([InlineKeyboardButton(
+            f"👤 {emp} — {total} баллов",
+            callback_data=router.data("month_emp_", month, emp)
+        )])
+    
+    keyboard += page_buttons("month_page_", (month,), has_prev, has_next,
+                             (ranking[0][1], ranking[0][0]), (ranking[-1][1], ranking[-1][0]))
+    keyboard.append([InlineKeyboardButton("◀️ Назад к месяцам", callback_data="show_months")])
+    keyboard.append([MAIN_MENU_BUTTON])
+    
+    return text + "\n" + "Выберите сотрудника для детализации:", InlineKeyboardMarkup(keyboard)
+
+@router.route("month_")
+@router.route("month_page_")
+async def show_month(query, context, is_admin_user, month, direction=PAGE_FORWARD, total=None, employee=None):
+    # Показываем страницу сотрудников за выбранный месяц
+    backward = direction == PAGE_BACKWARD
+    cursor = (total, employee) if employee is not None else None
+    text, reply_markup = await cached_render(('month', month, backward, cursor), month,
+                                             render_month, month, backward, cursor)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+# ============= НОВЫЙ ОБРАБОТЧИК month_emp_ =============
+async def render_month_employee(month, employee):
+    """Экран детализации штрафов сотрудника за месяц: (текст, клавиатура)"""
+    total, reasons_summary = await db.read(get_employee_fines_summary_by_month, employee, month)
+    
+    # Форматируем название месяца
+    month_name, year = format_month(month)
+    
+    text = f"👤 **{employee}**\n"
+    text += f"📅 {month_name} {year}\n"
+    text += f"💰 **Общая сумма штрафов: {total} баллов**\n\n"
+    
+    if reasons_summary:
+        text += "📋 **Детализация по причинам:**\n"
+        text += "═" * 25 + "\n"
+        
+        for reason, count, amount in reasons_summary:
+            if amount >= 50:
+                emoji = "🔴"
+            elif amount >= 25:
+                emoji = "🟠"
+            else:
+                emoji = "🟡"
             
-            # Добавляем отметку для текущего месяца
-            if month == current:
-                display_text += " (текущий)"
-                
-            keyboard.append([InlineKeyboardButton(
-                display_text,
-                callback_data=f"month_{month}"
-            )])
-        
-        keyboard.append([InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")])
+            text += f"{emoji} **{reason}**\n"
+            text += f"   └─ {count} штраф(ов) на {amount} баллов\n"
         
-        await query.edit_message_text(
-            "📅 Выберите месяц для просмотра:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        text += "═" * 25 + "\n"
+    else:
+        text += "❌ Нет штрафов за этот месяц\n"
     
-    # ============= НОВЫЙ ОБРАБОТЧИК month_ =============
-    elif query.data.startswith("month_"):
-        # Показываем список сотрудников за выбранный месяц
-        month = query.data[6:]
-        monthly_fines = get_monthly_fines_by_month(month)
-        
-        if not monthly_fines:
-            await query.edit_message_text(
-                f"📊 Штрафы за {month}\n\n"
-                f"За этот месяц штрафов нет.",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("◀️ Назад к месяцам", callback_data="show_months"),
-                    InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")
-                ]])
-            )
+    keyboard = [
+        [InlineKeyboardButton("◀️ Назад к сотрудникам", callback_data=router.data("month_", month))],
+        [InlineKeyboardButton("◀️ Назад к месяцам", callback_data="show_months")],
+        [MAIN_MENU_BUTTON]
+    ]
+    
+    return text, InlineKeyboardMarkup(keyboard)
+
+@router.route("month_emp_", parse=parse_month_employee)
+async def show_month_employee(query, context, is_admin_user, month, employee):
+    # Показываем детализацию штрафов сотрудника за выбранный месяц
+    text, reply_markup = await cached_render(('month_emp', month, employee), month,
+                                             render_month_employee, month, employee)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+@router.route("back_to_fines_list")
+async def back_to_fines_list(query, context, is_admin_user):
+    # Возврат к списку сотрудников со штрафами
+    snapshot = await db.read(get_month_snapshot)
+    
+    keyboard = []
+    for emp, total, count, last_at in snapshot:
+        keyboard.append([InlineKeyboardButton(
+            f"{emp} — {total} баллов", 
+            callback_data=router.data("view_employee_", emp)
+        )])
+    
+    if is_admin_user:
+        keyboard.append([
+            InlineKeyboardButton("📝 Добавить штраф", callback_data="add_fine"),
+            InlineKeyboardButton("✏️ Корректировка", callback_data="adjust_fines")
+        ])
+    
+    keyboard.append([MAIN_MENU_BUTTON])
+    
+    await query.edit_message_text(
+        f"📊 ШТРАФЫ ЗА {get_current_month()}\n\n"
+        f"Выберите сотрудника для просмотра детальной информации:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+# ============= ТРЕНДЫ ПО МЕСЯЦАМ =============
+async def render_trends():
+    """Экран трендов всех сотрудников: (текст, клавиатура)"""
+    trends = await db.read(get_employee_trends)
+
+    if not trends:
+        return "📈 Тренды\n\nШтрафов пока нет.", MAIN_MENU_KEYBOARD
+
+    months = [row[0] for row in next(iter(trends.values()))[0]]
+    first_name, first_year = format_month(months[0])
+    last_name, last_year = format_month(months[-1])
+
+    text = f"📈 ТРЕНДЫ: {first_name} {first_year} — {last_name} {last_year}\n"
+    text += "═" * 25 + "\n"
+    text += "Столбики — баллы по месяцам, от старых к новым\n\n"
+
+    # Сверху — сотрудники с наибольшим средним за последние 3 месяца
+    for emp, (series, reasons) in sorted(trends.items(), key=lambda item: -item[1][0][-1][4]):
+        month, total, count, change, rolling = series[-1]
+        change_text = f"{change:+d} к прошлому" if change is not None else "первый месяц"
+        text += f"👤 {emp}  {sparkline([row[1] for row in series])}\n"
+        text += f"   {format_month(month)[0]}: {total} баллов ({change_text}), "
+        text += f"в среднем за 3 мес.: {round(rolling)}\n"
+        for reason, reason_months, fines in reasons:
+            text += f"   🔁 {reason} — {reason_months} мес., штрафов: {fines}\n"
+        text += "\n"
+
+    return text.rstrip(), MAIN_MENU_KEYBOARD
+
+@router.route("trends")
+async def show_trends(query, context, is_admin_user):
+    # Экран зависит от всех месяцев: любая запись сбрасывает его из кэша
+    text, reply_markup = await cached_render(('trends',), ALL_MONTHS, render_trends)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+# ============= ЭКСПОРТ: КОМАНДА И КНОПКИ =============
+# Одновременно готовится одна выгрузка: она занимает поток чтения БД на всё
+# время записи файла, остальные потоки продолжают обслуживать пользователей
+_export_slot = asyncio.Semaphore(1)
+
+async def send_export(bot, chat_id, month=None, fmt='csv'):
+    """Готовит выгрузку в потоке чтения БД и отправляет её документом"""
+    async with _export_slot:
+        spool, filename, count = await db.read(export_fines, month, fmt)
+    with spool:
+        size = spool.seek(0, os.SEEK_END)
+        spool.seek(0)
+        if size > EXPORT_MAX_BYTES:
+            await bot.send_message(chat_id, f"❌ Выгрузка {filename} больше {EXPORT_MAX_BYTES // 1024 // 1024} МБ, "
+                                            f"выгрузите месяцы по отдельности")
             return
-        
-        # Форматируем название месяца для заголовка
-        year, month_num = month.split('-')
-        month_names = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
-                      "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"]
-        month_name = month_names[int(month_num) - 1]
-        
-        text = f"📊 ШТРАФЫ ЗА {month_name.upper()} {year}\n"
-        text += "═" * 25 + "\n\n"
-        
-        # Сортируем по сумме (от большего к меньшему)
-        sorted_fines = sorted(monthly_fines.items(), key=lambda x: x[1], reverse=True)
-        
-        keyboard = []
-        for emp, total in sorted_fines:
-            text += f"👤 {emp}: {total} баллов\n"
-            # Добавляем кнопку для просмотра деталей
-            safe_emp = safe_callback(emp)
-            keyboard.append([InlineKeyboardButton(
-                f"👤 {emp} — {total} баллов",
-                callback_data=f"month_emp_{month}_{safe_emp}"
-            )])
-        
-        keyboard.append([InlineKeyboardButton("◀️ Назад к месяцам", callback_data="show_months")])
-        keyboard.append([InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")])
-        
-        await query.edit_message_text(
-            text + "\n" + "Выберите сотрудника для детализации:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        await bot.send_document(chat_id, document=spool, filename=filename,
+                                caption=f"📤 {filename}: {count} строк")
+
+EXPORT_USAGE = ("Использование: /export [ГГГГ-ММ | all] [" + " | ".join(FORMATS) + "]\n"
+                "Без аргументов — текущий месяц в CSV")
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with handling("export", update.effective_user.id):
+        await _export_command(update, context)
+
+async def _export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Выгрузка доступна только администраторам.")
+        return
     
-    # ============= НОВЫЙ ОБРАБОТЧИК month_emp_ =============
-    elif query.data.startswith("month_emp_"):
-        # Показываем детализацию штрафов сотрудника за выбранный месяц
-        parts = query.data.split('_')
-        month = parts[2]
-        employee_raw = '_'.join(parts[3:])
-        
-        # Восстанавливаем оригинальное имя сотрудника
-        employee = employee_raw.replace('_', ' ')
-        
-        total, reasons_summary = get_employee_fines_summary_by_month(employee, month)
-        
-        # Форматируем название месяца
-        year, month_num = month.split('-')
-        month_names = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
-                      "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"]
-        month_name = month_names[int(month_num) - 1]
-        
-        text = f"👤 **{employee}**\n"
-        text += f"📅 {month_name} {year}\n"
-        text += f"💰 **Общая сумма штрафов: {total} баллов**\n\n"
-        
-        if reasons_summary:
-            text += "📋 **Детализация по причинам:**\n"
-            text += "═" * 25 + "\n"
-            
-            for reason, count, amount in reasons_summary:
-                if amount >= 50:
-                    emoji = "🔴"
-                elif amount >= 25:
-                    emoji = "🟠"
-                else:
-                    emoji = "🟡"
-                
-                text += f"{emoji} **{reason}**\n"
-                text += f"   └─ {count} штраф(ов) на {amount} баллов\n"
-            
-            text += "═" * 25 + "\n"
+    month, fmt = get_current_month(), 'csv'
+    for arg in context.args or ():
+        arg = arg.lower()
+        if arg in FORMATS:
+            fmt = arg
+        elif arg in WRITERS:
+            await update.message.reply_text(f"❌ Формат {arg.upper()} недоступен: на сервере не установлен openpyxl")
+            return
+        elif arg == 'all':
+            month = None
         else:
-            text += "❌ Нет штрафов за этот месяц\n"
-        
-        keyboard = [
-            [InlineKeyboardButton("◀️ Назад к сотрудникам", callback_data=f"month_{month}")],
-            [InlineKeyboardButton("◀️ Назад к месяцам", callback_data="show_months")],
-            [InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")]
-        ]
-        
-        await query.edit_message_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
-        )
+            try:
+                month = parse_month(arg)
+            except ValueError:
+                await update.message.reply_text(EXPORT_USAGE)
+                return
     
-    elif query.data == "back_to_fines_list":
-        # Возврат к списку сотрудников со штрафами
-        employees_with_fines = get_all_employees_with_fines()
-        
-        keyboard = []
-        for emp in employees_with_fines:
-            total = get_employee_total(emp)
-            keyboard.append([InlineKeyboardButton(
-                f"{emp} — {total} баллов", 
-                callback_data=f"view_employee_{emp}"
-            )])
-        
-        if is_admin_user:
-            keyboard.append([
-                InlineKeyboardButton("📝 Добавить штраф", callback_data="add_fine"),
-                InlineKeyboardButton("✏️ Корректировка", callback_data="adjust_fines")
-            ])
-        
-        keyboard.append([InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")])
-        
+    await update.message.reply_text("⏳ Готовлю выгрузку...")
+    await send_export(context.bot, update.effective_chat.id, month, fmt)
+
+@router.route("export", admin_only=True)
+async def show_export(query, context, is_admin_user):
+    keyboard = []
+    for index, fmt in enumerate(FORMATS):
+        keyboard.append([
+            InlineKeyboardButton(f"📄 Текущий месяц ({fmt.upper()})",
+                                 callback_data=router.data("export_month_", index, get_current_month())),
+            InlineKeyboardButton(f"🗂 Все месяцы ({fmt.upper()})", callback_data=router.data("export_all_", index)),
+        ])
+    keyboard.append([MAIN_MENU_BUTTON])
+    
+    await query.edit_message_text(
+        "📤 Экспорт штрафов\n\n"
+        "Файл придёт отдельным сообщением. Любой месяц можно выгрузить командой "
+        "/export ГГГГ-ММ",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+@router.route("export_month_", admin_only=True)
+@router.route("export_all_", admin_only=True)
+async def export_by_button(query, context, is_admin_user, fmt_index, month=None):
+    fmt = FORMATS[fmt_index] if fmt_index in range(len(FORMATS)) else 'csv'
+    await query.edit_message_text(
+        f"⏳ Готовлю выгрузку за {month or 'все месяцы'} ({fmt.upper()})...",
+        reply_markup=MAIN_MENU_KEYBOARD
+    )
+    await send_export(context.bot, query.message.chat_id, month, fmt)
+
+# ============= ПОИСК: КОМАНДА И СТРАНИЦЫ =============
+# Последний запрос хранится в context.user_data['search'], кнопки листания несут только номер страницы
+
+SEARCH_USAGE = ("Использование: /search слова [ГГГГ-ММ[-ДД][..ГГГГ-ММ[-ДД]]]\n"
+                "Например: /search грязное 2024-07..2024-09\n"
+                "Ищет по имени сотрудника и нарушению, можно начало слова")
+
+async def render_search(text, page):
+    """Текст и клавиатура страницы результатов поиска"""
+    try:
+        rows, has_next = await db.read(search_fines, text, page)
+    except ValueError:
+        return f"❌ Неверная дата в запросе\n\n{SEARCH_USAGE}", MAIN_MENU_KEYBOARD
+
+    if not rows and not page:
+        return f"🔍 По запросу «{text}» ничего не найдено", MAIN_MENU_KEYBOARD
+
+    lines = [f"🔍 Поиск: «{text}», страница {page + 1}\n"]
+    for fine_id, created_at, employee, reason, amount in rows:
+        lines.append(f"• {format_timestamp(created_at)} — {employee}\n  {reason} ({amount} баллов)")
+
+    row = []
+    if page:
+        row.append(InlineKeyboardButton("⬅️ Предыдущие", callback_data=router.data("search_page_", page - 1)))
+    if has_next:
+        row.append(InlineKeyboardButton("Следующие ➡️", callback_data=router.data("search_page_", page + 1)))
+    keyboard = [row] if row else []
+    keyboard.append([MAIN_MENU_BUTTON])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with handling("search", update.effective_user.id):
+        await _search_command(update, context)
+
+async def _search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = " ".join(context.args or ())
+    if not text:
+        await update.message.reply_text(SEARCH_USAGE)
+        return
+
+    context.user_data['search'] = text
+    message, reply_markup = await render_search(text, 0)
+    await update.message.reply_text(message, reply_markup=reply_markup)
+
+@router.route("search_page_")
+async def show_search_page(query, context, is_admin_user, page):
+    text = context.user_data.get('search')
+    if not text:
+        await query.edit_message_text(f"Запрос устарел, повторите поиск\n\n{SEARCH_USAGE}",
+                                      reply_markup=MAIN_MENU_KEYBOARD)
+        return
+
+    message, reply_markup = await render_search(text, max(page, 0))
+    await query.edit_message_text(message, reply_markup=reply_markup)
+
+# ============= АДМИНИСТРАТОРЫ: КОМАНДА =============
+# Администраторы из ADMIN_IDS заданы в коде; командой добавляются и удаляются
+# записи таблицы admins, реестр обновляется сразу
+
+ADMINS_USAGE = ("Использование:\n"
+                "/admins — список администраторов\n"
+                "/admins add ID [имя] — добавить\n"
+                "/admins remove ID — удалить")
+
+async def admins_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with handling("admins", update.effective_user.id):
+        await _admins_command(update, context)
+
+async def _admins_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Управление администраторами доступно только администраторам.")
+        return
+
+    args = list(context.args or ())
+    action = args[0].lower() if args else 'list'
+    try:
+        user_id = int(args[1]) if action in ('add', 'remove') else None
+    except (IndexError, ValueError):
+        await update.message.reply_text(ADMINS_USAGE)
+        return
+
+    if action == 'add':
+        username = " ".join(args[2:]) or None
+        await db.write(add_admin, user_id, username)
+        logger.info("Добавлен администратор", extra=log_fields('admin', user_id=user_id,
+                                                               by=update.effective_user.id))
+        await update.message.reply_text(f"✅ Администратор {user_id} добавлен")
+    elif action == 'remove':
+        if user_id in ADMIN_IDS:
+            await update.message.reply_text(f"❌ {user_id} задан в ADMIN_IDS в коде бота, командой его не удалить")
+            return
+        await db.write(remove_admin, user_id)
+        logger.info("Удалён администратор", extra=log_fields('admin', user_id=user_id,
+                                                             by=update.effective_user.id))
+        await update.message.reply_text(f"✅ Администратор {user_id} удалён")
+    elif action == 'list':
+        text = "👮 Администраторы\n\nИз ADMIN_IDS:\n"
+        text += "".join(f"   • {admin_id}\n" for admin_id in ADMIN_IDS)
+        db_admins = await db.read(get_db_admins)
+        if db_admins:
+            text += "\nДобавлены командой:\n"
+            text += "".join(f"   • {admin_id}{f' ({username})' if username else ''} — с {added_date}\n"
+                            for admin_id, username, added_date in db_admins)
+        await update.message.reply_text(text)
+    else:
+        await update.message.reply_text(ADMINS_USAGE)
+
+@router.route("no_action")
+async def no_action(query, context, is_admin_user):
+    await query.answer("Нет доступных действий")
+
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    route, args = router.resolve(query.data)
+    with handling(route.name if route else "unknown", query.from_user.id):
+        await _dispatch(query, context, route, args)
+
+async def _dispatch(query, context, route, args):
+    await query.answer()
+    
+    user_id = query.from_user.id
+    is_admin_user = is_admin(user_id)
+    
+    logger.debug("Callback", extra=log_fields('callback', user_id=user_id, data=query.data, is_admin=is_admin_user))
+    
+    if route is None:
+        logger.warning("Неизвестный callback", extra=log_fields('callback', user_id=user_id, data=query.data))
+        return
+    
+    # Проверяем права доступа для административных функций
+    if route.admin_only and not is_admin_user:
         await query.edit_message_text(
-            f"📊 ШТРАФЫ ЗА {get_current_month()}\n\n"
-            f"Выберите сотрудника для просмотра детальной информации:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            "⛔ У вас нет прав для выполнения этого действия.\n\n"
+            "Только администраторы могут добавлять и корректировать штрафы.",
+            reply_markup=NO_RIGHTS_KEYBOARD
         )
+        return
     
-    elif query.data == "no_action":
-        await query.answer("Нет доступных действий")
+    await route.handler(query, context, is_admin_user, *args)
 
-def main():
-    # Инициализация БД
+def register_app_metrics(application: Application):
+    """Метрики, которые читают состояние приложения в момент сбора"""
+    metrics.gauge('bot_update_queue_depth', 'Обновления в очереди Application',
+                  lambda: application.update_queue.qsize())
+    metrics.gauge('bot_updates_in_progress', 'Обновления, которые обрабатываются сейчас',
+                  lambda: application.update_processor.in_progress)
+    metrics.gauge('bot_update_users_active', 'Пользователи с обновлением в обработке или в очереди',
+                  lambda: application.update_processor.waiting_users)
+    metrics.gauge('bot_persistence_pending', 'Записей user_data/chat_data, ожидающих записи в базу',
+                  lambda: application.persistence.pending)
+    metrics.gauge('bot_render_cache_size', 'Экранов в кэше архива',
+                  lambda: render_cache.stats()['size'])
+    metrics.gauge('bot_render_cache_hits_total', 'Попадания в кэш экранов архива',
+                  lambda: render_cache.stats()['hits'], 'counter')
+    metrics.gauge('bot_render_cache_misses_total', 'Промахи кэша экранов архива',
+                  lambda: render_cache.stats()['misses'], 'counter')
+
+# Health check сервер (/livez, /readyz, /metrics) работает на event loop бота
+health_server = HealthServer(port=int(os.environ.get('PORT', 10000)))
+
+async def post_init(application: Application):
+    # Следим, чтобы event loop не блокировался
+    loop_lag.start()
+    await health_server.start()
+
+async def post_shutdown(application: Application):
+    await health_server.stop()
+    await loop_lag.stop()
+    logger.info("Задержка event loop за время работы", extra=log_fields('shutdown', **loop_lag.report()))
+    logger.info("Кэш экранов архива", extra=log_fields('shutdown', **render_cache.stats()))
+
+# ============= ЗАПУСК =============
+# Этапы запуска пишутся в профиль: import, db (открытие и миграции), telegram_init
+# (getMe), cache_warm и отправка первого getUpdates (в webhook — set_webhook).
+# db и telegram_init идут параллельно, прогрев кэша — в фоне после них
+
+startup = StartupProfile(IMPORT_STARTED)
+metrics.register(startup)
+metrics.gauge('bot_startup_seconds', 'Время от начала импорта до конца последнего этапа запуска',
+              lambda: startup.total)
+
+# Бюджет времени до первого getUpdates (или set_webhook) в секундах; превышение — предупреждение в лог
+STARTUP_BUDGET = float(os.environ.get('STARTUP_BUDGET', 5))
+
+def report_startup():
+    logger.info(f"⏱ Запуск: {startup.report()}",
+                extra=log_fields('startup', total_s=round(startup.total, 3), budget_s=STARTUP_BUDGET))
+    if startup.total > STARTUP_BUDGET:
+        logger.warning("Запуск не уложился в бюджет",
+                       extra=log_fields('startup', total_s=round(startup.total, 3), budget_s=STARTUP_BUDGET))
+
+def open_storage():
+    """Открывает базу, применяет миграции и загружает администраторов"""
     init_db()
+    refresh_admins()
+
+async def warm_cache():
+    """Строит экраны, которые после простоя открывают первыми: текущий месяц в архиве и тренды"""
+    try:
+        with startup.phase('cache_warm'):
+            month = get_current_month()
+            await cached_render(('month', month, False, None), month, render_month, month, False, None)
+            await cached_render(('trends',), ALL_MONTHS, render_trends)
+    except Exception:
+        logger.exception("Не удалось прогреть кэш экранов", extra=log_fields('startup'))
+
+async def prepare(application: Application):
+    """База открывается и мигрирует в потоке записи, пока Application делает getMe.
+    Возвращает фоновую задачу прогрева кэша"""
+    async def storage():
+        with startup.phase('db'):
+            await db.write(open_storage)
+
+    async def telegram():
+        with startup.phase('telegram_init'):
+            await application.initialize()
+
+    await asyncio.gather(storage(), telegram())
+    return asyncio.create_task(warm_cache())
+
+# Устанавливается, когда отправлен первый getUpdates
+polling_started = asyncio.Event()
+
+def _on_get_updates(api_method):
+    """on_request запроса getUpdates: момент отправки первого запроса завершает запуск.
+    Ответа не ждём — без новых обновлений long polling держит его до timeout секунд"""
+    if not polling_started.is_set():
+        startup.record('first_get_updates')
+        polling_started.set()
+
+async def report_startup_when_ready(warm, ready=None):
+    """Пишет отчёт о запуске, когда пройден последний этап (ready) и прогрет кэш"""
+    if ready is not None:
+        await ready.wait()
+    await warm
+    report_startup()
+
+def _stop_on_signals(stop_event):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+# Публичный адрес бота для webhook, например https://fines-bot.onrender.com
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+# Адрес Bot API (например, локальный fake_telegram.py для проверок)
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL')
+# Сколько обновлений разных пользователей обрабатывать одновременно (1 — по одному)
+MAX_CONCURRENT_UPDATES = int(os.environ.get('MAX_CONCURRENT_UPDATES', 32))
+# Раз в столько секунд изменённые user_data/chat_data пачкой пишутся в базу
+PERSISTENCE_INTERVAL = float(os.environ.get('PERSISTENCE_INTERVAL', 10))
+
+def build_application(token, base_url=None):
+    """Создаёт Application со всеми обработчиками. Запускать через run_polling или run_webhook"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(TimedHTTPXRequest(connection_pool_size=256))
+        .get_updates_request(TimedHTTPXRequest(on_request=_on_get_updates))
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .persistence(SQLitePersistence(update_interval=PERSISTENCE_INTERVAL))
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    app = builder.build()
+    register_app_metrics(app)
+
+    # Добавляем обработчики (с правильным отступом!)
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("export", export_command))
+    app.add_handler(CommandHandler("search", search_command))
+    app.add_handler(CommandHandler("admins", admins_command))
+    app.add_handler(CallbackQueryHandler(button_handler))
+    return app
+
+def make_webhook_endpoint(application: Application, secret):
+    """Обработчик POST-запросов Telegram для health-сервера"""
+    async def webhook_endpoint(request):
+        if secret:
+            received = request.headers.get('x-telegram-bot-api-secret-token', '')
+            if not hmac.compare_digest(received.encode(), secret.encode()):
+                return 403, 'text/plain', b'Forbidden'
+        try:
+            payload = json.loads(request.body)
+        except ValueError:
+            return 400, 'text/plain', b'Bad update'
+        # Обновление — всегда JSON-объект: на "x" de_json падает, а null даёт None
+        if not isinstance(payload, dict):
+            return 400, 'text/plain', b'Bad update'
+        try:
+            update = Update.de_json(payload, application.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400, 'text/plain', b'Bad update'
+        await application.update_queue.put(update)
+        return 200, 'text/plain', b'ok'
+    return webhook_endpoint
+
+async def run_polling(application: Application, stop_event=None):
+    """Получает обновления через long polling"""
+    stop_event = stop_event or asyncio.Event()
+    _stop_on_signals(stop_event)
+    
+    # Health-сервер поднимается первым: хостинг проверяет его, пока идёт запуск
+    await post_init(application)
+    try:
+        warm = await prepare(application)
+        await application.updater.start_polling()
+        report = asyncio.create_task(report_startup_when_ready(warm, polling_started))
+        await application.start()
+        try:
+            await stop_event.wait()
+        finally:
+            report.cancel()
+            await application.updater.stop()
+            await application.stop()
+            await warm
+    finally:
+        await application.shutdown()
+        await post_shutdown(application)
+
+async def run_webhook(application: Application, webhook_url, secret=None, stop_event=None):
+    """Получает обновления через webhook на порту health-сервера (PORT)"""
+    health_server.add_route(WEBHOOK_PATH, make_webhook_endpoint(application, secret), methods=('POST',))
+    stop_event = stop_event or asyncio.Event()
+    _stop_on_signals(stop_event)
+    
+    await post_init(application)
+    try:
+        warm = await prepare(application)
+        await application.bot.set_webhook(
+            webhook_url.rstrip('/') + WEBHOOK_PATH,
+            secret_token=secret,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        startup.record('set_webhook')
+        report = asyncio.create_task(report_startup_when_ready(warm))
+        await application.start()
+        try:
+            await stop_event.wait()
+        finally:
+            report.cancel()
+            await application.stop()
+            await warm
+    finally:
+        await application.shutdown()
+        await post_shutdown(application)
+
+async def measure_startup():
+    """Этапы запуска без сети (база и прогрев кэша) — для отслеживания бюджета.
+    Возвращает True, если запуск уложился в STARTUP_BUDGET"""
+    with startup.phase('db'):
+        await db.write(open_storage)
+    await warm_cache()
+    report_startup()
+    return startup.total <= STARTUP_BUDGET
+
+def main():
+    startup.record('import')
     
-    # Вывод информации об администраторах
-    print("=" * 50)
-    print("ВАЖНО: Не забудьте заменить ADMIN_IDS на реальные ID!")
-    print("Как получить ID: напишите боту @userinfobot")
-    print("Текущие ID администраторов:", ADMIN_IDS)
-    print("=" * 50)
+    # ID администраторов берутся у @userinfobot; не забудьте заменить ADMIN_IDS на реальные
+    logger.info("Администраторы из ADMIN_IDS", extra=log_fields('startup', admin_ids=ADMIN_IDS))
     
     # Получаем токен из переменных окружения
     token = os.environ.get('BOT_TOKEN')
     
     if not token:
-        print("❌ ОШИБКА: BOT_TOKEN не найден в переменных окружения!")
-        print("Проверьте настройки Environment Variables на Render/BotHost")
+        logger.error("❌ BOT_TOKEN не найден в переменных окружения! "
+                     "Проверьте настройки Environment Variables на Render/BotHost")
         return
     
-    print(f"✅ Токен получен: {token[:10]}...")  # Показываем начало токена для проверки
+    # Начало токена — для проверки, что подставлен нужный
+    logger.info("✅ Токен получен", extra=log_fields('startup', token_prefix=token[:10]))
     
-    # Создаем приложение
-    app = Application.builder().token(token).build()
-
-    # Добавляем обработчики (с правильным отступом!)
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CallbackQueryHandler(button_handler))
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        logger.error("❌ Для BOT_MODE=webhook нужен WEBHOOK_URL")
+        return
+    
+    # Создаем приложение; база открывается уже на event loop, параллельно с getMe
+    with startup.phase('build'):
+        app = build_application(token, TELEGRAM_API_URL)
 
-    print("✅ Бот запущен...")
-    app.run_polling()
+    logger.info("✅ Бот запущен", extra=log_fields('startup', mode=BOT_MODE))
+    try:
+        if BOT_MODE == 'webhook':
+            asyncio.run(run_webhook(app, WEBHOOK_URL, WEBHOOK_SECRET))
+        else:
+            asyncio.run(run_polling(app))
+    finally:
+        db.shutdown()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    setup_logging()
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "migrate":
+        init_db()
+        print(f"Версия схемы БД: {db.schema_version()}")
+    elif command == "check-plans":
+        check_query_plans()
+    elif command == "verify-totals":
+        init_db()
+        mismatches = verify_monthly_totals()
+        for row in mismatches:
+            print("❌ Расхождение:", row)
+        print("✅ Итоги совпадают с fines" if not mismatches else f"Найдено расхождений: {len(mismatches)}")
+        sys.exit(1 if mismatches else 0)
+    elif command == "close-month":
+        # close-month [YYYY-MM]: без месяца закрывает все закончившиеся
+        init_db()
+        try:
+            if len(sys.argv) > 2:
+                month = parse_month(sys.argv[2])
+                closed = [(month, close_month(month))]
+            else:
+                closed = close_finished_months()
+        except ValueError as error:
+            print(f"❌ {error}")
+            sys.exit(1)
+        for month, count in closed:
+            print(f"✅ Месяц {month} закрыт: {count} строк в {archive_dir()}")
+        if not closed:
+            print("Нет закончившихся незакрытых месяцев")
+    elif command == "rebuild-totals":
+        init_db()
+        rebuild_monthly_totals()
+        print("✅ Итоги monthly_totals пересчитаны")
+    elif command == "rebuild-search":
+        init_db()
+        rebuild_search_index()
+        print("✅ Индекс поиска fines_fts перестроен")
+    elif command == "startup-profile":
+        # Код выхода 1 — запуск не уложился в STARTUP_BUDGET
+        startup.record('import')
+        within_budget = asyncio.run(measure_startup())
+        db.shutdown()
+        sys.exit(0 if within_budget else 1)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,90 @@
+import os
+import threading
+from collections import OrderedDict
+
+# «Месяц» экранов, которые строятся по всем месяцам сразу: запись в любой месяц сбрасывает и их
+ALL_MONTHS = '*'
+
+
+class RenderCache:
+    """Ограниченный LRU-кэш готовых экранов (текст, клавиатура) по месяцам.
+
+    Каждый ключ привязан к месяцу. Запись в месяц сбрасывает все его экраны
+    и увеличивает поколение месяца: экран, который начали строить до записи,
+    не попадёт в кэш (put с устаревшим поколением игнорируется).
+    Записи идут из потока БД, чтения — из event loop, поэтому всё под lock.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._items = OrderedDict()
+        self._keys_by_month = {}
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._items[key][1]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self, month):
+        with self._lock:
+            return self._epoch, self._generations.get(month, 0)
+
+    def put(self, key, month, value, generation):
+        with self._lock:
+            if (self._epoch, self._generations.get(month, 0)) != generation:
+                return
+            self._items[key] = (month, value)
+            self._items.move_to_end(key)
+            self._keys_by_month.setdefault(month, set()).add(key)
+            while len(self._items) > self.maxsize:
+                old_key, (old_month, _) = self._items.popitem(last=False)
+                self._discard_month_key(old_month, old_key)
+                self.evictions += 1
+
+    def invalidate_month(self, month):
+        with self._lock:
+            for each in (month, ALL_MONTHS):
+                self._generations[each] = self._generations.get(each, 0) + 1
+                for key in self._keys_by_month.pop(each, ()):
+                    self._items.pop(key, None)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._items.clear()
+            self._keys_by_month.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def _discard_month_key(self, month, key):
+        keys = self._keys_by_month.get(month)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_month[month]
+
+
+render_cache = RenderCache(int(os.environ.get('RENDER_CACHE_SIZE', 256)))
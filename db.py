@@ -0,0 +1,208 @@
+import os
+import asyncio
+import functools
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from monitoring import DB_QUERY_LATENCY
+
+# Путь к базе можно переопределить через переменную окружения
+DB_PATH = os.environ.get('FINES_DB', 'fines.db')
+
+# Настройки соединения: WAL позволяет читать параллельно с записью,
+# synchronous=NORMAL в режиме WAL не делает fsync на каждый commit
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+)
+
+# Размер кэша подготовленных выражений на соединение
+STATEMENT_CACHE_SIZE = 128
+
+# Сколько потоков читают параллельно (у каждого своё соединение)
+READ_WORKERS = int(os.environ.get('DB_READ_WORKERS', 4))
+
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_write_lock = threading.RLock()
+
+# Чтения идут в пул потоков, записи — в один выделенный поток
+_read_executor = None
+_write_executor = None
+_executors_lock = threading.Lock()
+
+
+def _open_connection(path):
+    """Открывает соединение и применяет PRAGMA"""
+    conn = sqlite3.connect(
+        path,
+        timeout=10,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection():
+    """Возвращает долгоживущее соединение текущего потока"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'path', None) != DB_PATH:
+        conn = _open_connection(DB_PATH)
+        _local.conn = conn
+        _local.path = DB_PATH
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+def close_all():
+    """Закрывает все открытые соединения (при остановке бота)"""
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+    _local.__dict__.clear()
+
+
+def fetch_all(sql, params=()):
+    return get_connection().execute(sql, params).fetchall()
+
+
+def fetch_one(sql, params=()):
+    return get_connection().execute(sql, params).fetchone()
+
+
+def fetch_value(sql, params=(), default=None):
+    """Возвращает первое поле первой строки или default"""
+    row = fetch_one(sql, params)
+    if row is None or row[0] is None:
+        return default
+    return row[0]
+
+
+@contextmanager
+def transaction():
+    """Транзакция на запись: одна за раз, BEGIN IMMEDIATE ... COMMIT"""
+    with _write_lock:
+        conn = get_connection()
+        if conn.in_transaction:
+            # Вложенный вызов — работаем в уже открытой транзакции
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+
+# ============= АСИНХРОННЫЙ API ДЛЯ ОБРАБОТЧИКОВ =============
+
+def _get_executors():
+    global _read_executor, _write_executor
+    with _executors_lock:
+        if _read_executor is None:
+            _read_executor = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix='db-read')
+        if _write_executor is None:
+            _write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write')
+        return _read_executor, _write_executor
+
+
+def _timed(func, *args, **kwargs):
+    with DB_QUERY_LATENCY.time(getattr(func, '__name__', 'unknown')):
+        return func(*args, **kwargs)
+
+
+async def read(func, *args, **kwargs):
+    """Выполняет читающую функцию в пуле потоков, не блокируя event loop"""
+    executor = _get_executors()[0]
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(_timed, func, *args, **kwargs))
+
+
+async def write(func, *args, **kwargs):
+    """Выполняет пишущую функцию в потоке записи (строго по очереди)"""
+    executor = _get_executors()[1]
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(_timed, func, *args, **kwargs))
+
+
+def shutdown():
+    """Дожидается незавершённых операций и закрывает соединения"""
+    global _read_executor, _write_executor
+    with _executors_lock:
+        executors = (_read_executor, _write_executor)
+        _read_executor = _write_executor = None
+    for executor in executors:
+        if executor is not None:
+            executor.shutdown(wait=True)
+    close_all()
+
+
+# ============= МИГРАЦИИ СХЕМЫ =============
+
+def schema_version():
+    return fetch_value('PRAGMA user_version', default=0)
+
+
+def migrate(migrations):
+    """Применяет недостающие миграции по порядку.
+
+    migrations — список (версия, описание, функция(conn)). Каждая миграция
+    выполняется в своей транзакции вместе с обновлением PRAGMA user_version,
+    поэтому прерванное обновление не оставляет базу в промежуточном состоянии.
+    Возвращает список применённых версий.
+    """
+    applied = []
+    for version, description, func in sorted(migrations, key=lambda m: m[0]):
+        with transaction() as conn:
+            current = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version <= current:
+                continue
+            func(conn)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+        applied.append((version, description))
+    return applied
+
+
+# ============= ПРОВЕРКА ПЛАНОВ ЗАПРОСОВ =============
+
+def capture_queries(func, *args, **kwargs):
+    """Выполняет функцию и возвращает SQL всех выполненных ею выражений"""
+    conn = get_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        func(*args, **kwargs)
+    finally:
+        conn.set_trace_callback(None)
+    return statements
+
+
+def explain(sql):
+    return [row[3] for row in get_connection().execute('EXPLAIN QUERY PLAN ' + sql)]
+
+
+def assert_uses_index(sql):
+    """Падает с AssertionError, если запрос читает таблицу полным сканированием.
+    Виртуальная таблица (FTS5) считается прочитанной по индексу, если ей передано условие"""
+    for detail in explain(sql):
+        if ' VIRTUAL TABLE INDEX ' in detail and not detail.endswith(':'):
+            continue
+        if detail.startswith('SCAN ') and ' USING ' not in detail:
+            raise AssertionError(f"Полное сканирование таблицы ({detail}) в запросе: {sql.strip()}")
@@ -0,0 +1,99 @@
+import codecs
+import csv
+import gzip
+import os
+import tempfile
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # openpyxl есть в requirements.txt; без него (локальная установка) доступен только CSV
+    Workbook = None
+
+# До этого размера файл держится в памяти, дальше SpooledTemporaryFile уходит на диск
+SPOOL_MAX_SIZE = 1024 * 1024
+
+# Строки CSV пишутся в файл пачками такого размера
+CSV_CHUNK_ROWS = 500
+
+FORMATS = ('csv', 'xlsx') if Workbook is not None else ('csv',)
+
+
+class _Chunk:
+    """Буфер для csv.writer: накапливает строки и отдаёт их одной строкой"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def pop(self):
+        text = ''.join(self.parts)
+        self.parts.clear()
+        return text
+
+
+def _write_csv(out, header, rows):
+    """UTF-8 с BOM, разделитель ';' — файл сразу открывается в Excel"""
+    out.write(codecs.BOM_UTF8)
+    chunk = _Chunk()
+    writer = csv.writer(chunk, delimiter=';')
+    writer.writerow(header)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % CSV_CHUNK_ROWS == 0:
+            out.write(chunk.pop().encode())
+    out.write(chunk.pop().encode())
+    return count
+
+
+def write_csv(header, rows):
+    """Пишет заголовок и строки из генератора rows в SpooledTemporaryFile.
+    Возвращает (файл с позицией в начале, количество строк)"""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    count = _write_csv(spool, header, rows)
+    spool.seek(0)
+    return spool, count
+
+
+def write_csv_gz(path, header, rows):
+    """Пишет CSV, сжатый gzip, в path. Файл появляется под своим именем только
+    целиком и после fsync. Возвращает количество строк"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as out:
+            count = _write_csv(out, header, rows)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(temp_path, path)
+    return count
+
+
+def read_csv_gz(path):
+    """Строки файла write_csv_gz без заголовка; значения — строки"""
+    with gzip.open(path, 'rt', encoding='utf-8-sig', newline='') as source:
+        reader = csv.reader(source, delimiter=';')
+        next(reader, None)
+        yield from reader
+
+
+def write_xlsx(header, rows):
+    """Как write_csv, но в XLSX (openpyxl в режиме write_only не держит строки в памяти)"""
+    if Workbook is None:
+        raise RuntimeError("Для XLSX нужен пакет openpyxl")
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Штрафы")
+    sheet.append(header)
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    workbook.save(spool)
+    spool.seek(0)
+    return spool, count
+
+
+WRITERS = {'csv': write_csv, 'xlsx': write_xlsx}
@@ -0,0 +1,166 @@
+"""Локальная замена Telegram Bot API для проверки режима webhook без сети.
+
+FakeTelegram отвечает на вызовы Bot API (/bot<token>/<method>) и записывает
+их, а deliver() отправляет обновление на webhook бота так же, как Telegram:
+POST с JSON и заголовком X-Telegram-Bot-Api-Secret-Token.
+
+Запуск сквозной проверки: python fake_telegram.py
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qsl
+
+import httpx
+
+import db
+from health import AsyncHTTPServer
+
+FAKE_BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_fines_bot"}
+
+
+class FakeTelegram(AsyncHTTPServer):
+    def __init__(self, host='127.0.0.1', port=8081):
+        super().__init__(host, port)
+        self.fallback = self._api_call
+        self.calls = []
+        self.webhook = None
+        self._message_id = 0
+        self._changed = asyncio.Condition()
+
+    @property
+    def base_url(self):
+        """Значение для Application.builder().base_url(...)"""
+        return f"http://{self.host}:{self.port}/bot"
+
+    def _parse_params(self, request):
+        if request.headers.get('content-type', '').startswith('application/json'):
+            return json.loads(request.body or b'{}')
+        params = {}
+        for key, value in parse_qsl(request.body.decode()):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    def _message(self, params):
+        self._message_id += 1
+        return {"message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": params.get("text", "")}
+
+    async def _api_call(self, request):
+        if not request.path.startswith('/bot') or request.path.count('/') != 2:
+            return 404, 'application/json', b'{"ok": false, "error_code": 404, "description": "Not Found"}'
+        method = request.path.rsplit('/', 1)[-1]
+        params = self._parse_params(request)
+
+        if method == 'getMe':
+            result = FAKE_BOT_USER
+        elif method == 'setWebhook':
+            self.webhook = params
+            result = True
+        elif method == 'deleteWebhook':
+            self.webhook = None
+            result = True
+        elif method == 'getUpdates':
+            result = []
+        elif method in ('sendMessage', 'editMessageText') and 'chat_id' in params:
+            result = self._message(params)
+        else:
+            result = True
+
+        async with self._changed:
+            self.calls.append((method, params, time.perf_counter()))
+            self._changed.notify_all()
+        return 200, 'application/json', json.dumps({"ok": True, "result": result}).encode()
+
+    async def wait_for_calls(self, method, count, timeout=5.0):
+        """Ждёт, пока метод будет вызван хотя бы count раз; возвращает время последнего вызова"""
+        def matched():
+            return [call for call in self.calls if call[0] == method]
+
+        async with self._changed:
+            await asyncio.wait_for(self._changed.wait_for(lambda: len(matched()) >= count), timeout)
+            return matched()[count - 1][2]
+
+    async def deliver(self, url, update, secret=None):
+        """Отправляет обновление на webhook. Возвращает (HTTP статус, время ответа в секундах)"""
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+        started = time.perf_counter()
+        async with httpx.AsyncClient() as client:
+            response = await client.post(url, json=update, headers=headers)
+        return response.status_code, time.perf_counter() - started
+
+
+def callback_update(update_id, user_id, data):
+    """Обновление с нажатием inline-кнопки"""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "chat_instance": "1",
+            "data": data,
+            "message": {"message_id": 1, "date": int(time.time()), "text": "menu",
+                        "chat": {"id": user_id, "type": "private"}},
+        },
+    }
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run_end_to_end(updates=50, api_port=8081, webhook_port=8082):
+    """Поднимает фейковый API и бота в режиме webhook, прогоняет нажатия кнопок"""
+    import bot
+
+    secret = 'e2e-secret'
+    fake = FakeTelegram(port=api_port)
+    await fake.start()
+    bot.health_server.port = webhook_port
+    bot.init_db()
+    bot.refresh_admins()
+    app = bot.build_application('123:FAKE', base_url=fake.base_url)
+    stop = asyncio.Event()
+    runner = asyncio.create_task(bot.run_webhook(app, f"http://127.0.0.1:{webhook_port}", secret, stop))
+    try:
+        await fake.wait_for_calls('setWebhook', 1)
+        url = fake.webhook['url']
+        assert fake.webhook.get('secret_token') == secret, fake.webhook
+
+        status, _ = await fake.deliver(url, callback_update(0, bot.ADMIN_IDS[0], 'check_fines'), 'wrong')
+        assert status == 403, f"неверный secret token должен отклоняться, получен {status}"
+
+        ingest, response = [], []
+        screens = ['check_fines', 'show_months', 'adjust_fines', 'add_fine']
+        for number in range(1, updates + 1):
+            update = callback_update(number, bot.ADMIN_IDS[0], screens[number % len(screens)])
+            status, elapsed = await fake.deliver(url, update, secret)
+            assert status == 200, status
+            sent = time.perf_counter() - elapsed
+            answered = await fake.wait_for_calls('editMessageText', number)
+            ingest.append(elapsed)
+            response.append(answered - sent)
+
+        for name, values in (("приём webhook", ingest), ("ответ бота", response)):
+            print(f"{name}: p50={statistics.median(values) * 1000:.1f} мс, "
+                  f"p99={_percentile(values, 0.99) * 1000:.1f} мс")
+        print(f"✅ Обработано обновлений: {updates}, неверный secret token отклонён")
+    finally:
+        stop.set()
+        await runner
+        await fake.stop()
+
+
+if __name__ == "__main__":
+    # Отдельная временная база, чтобы проверка не трогала fines.db
+    db.DB_PATH = os.environ.get('E2E_FINES_DB') or os.path.join(tempfile.mkdtemp(), 'fines.db')
+    asyncio.run(run_end_to_end(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
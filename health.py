@@ -0,0 +1,163 @@
+import asyncio
+import logging
+
+import db
+from monitoring import loop_lag, metrics
+
+logger = logging.getLogger(__name__)
+
+# Готовность: БД должна ответить за это время, а event loop не отставать сильнее
+READY_DB_TIMEOUT = 1.0
+READY_MAX_LOOP_LAG = 0.5
+
+# Медленный или зависший клиент не держит соединение дольше этого
+REQUEST_TIMEOUT = 5.0
+
+# Больше этого тело запроса не принимаем (обновления Telegram намного меньше)
+MAX_BODY_SIZE = 1024 * 1024
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+            405: 'Method Not Allowed', 413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+
+class Request:
+    __slots__ = ('method', 'path', 'query', 'headers', 'body')
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+
+class AsyncHTTPServer:
+    """Минимальный HTTP/1.1 сервер на asyncio: одно соединение — одна задача.
+
+    Обработчик маршрута — корутина handler(request) -> (статус, тип, тело).
+    fallback, если задан, получает запросы без точного маршрута.
+    """
+
+    def __init__(self, host='0.0.0.0', port=10000):
+        self.host = host
+        self.port = port
+        self.routes = {}
+        self.fallback = None
+        self._server = None
+
+    def add_route(self, path, handler, methods=('GET', 'HEAD')):
+        for method in methods:
+            self.routes[(method, path)] = handler
+
+    async def _dispatch(self, request):
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for method, path in self.routes):
+                return 405, 'text/plain', b'Method not allowed'
+            if self.fallback is None:
+                return 404, 'text/plain', b'Not found'
+            handler = self.fallback
+        return await handler(request)
+
+    async def _read_request(self, reader):
+        request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+        parts = request_line.decode('latin-1').split()
+        if len(parts) < 2:
+            return None
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_SIZE:
+            raise ValueError("Слишком большое тело запроса")
+        body = await asyncio.wait_for(reader.readexactly(length), REQUEST_TIMEOUT) if length else b''
+        path, _, query = parts[1].partition('?')
+        return Request(parts[0], path, query, headers, body)
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                request = await self._read_request(reader)
+            except ValueError:
+                request = None
+                status, content_type, body, method = 413, 'text/plain', b'Payload too large', 'POST'
+            else:
+                if request is None:
+                    return
+                status, content_type, body = await self._dispatch(request)
+                method = request.method
+            head = (
+                f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n"
+            ).encode()
+            writer.write(head if method == 'HEAD' else head + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            logger.exception("Ошибка в HTTP-сервере")
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+async def check_ready():
+    """Возвращает список проблем; пустой список — бот готов принимать запросы"""
+    problems = []
+    try:
+        await asyncio.wait_for(db.read(db.fetch_value, 'SELECT 1'), READY_DB_TIMEOUT)
+    except Exception as e:
+        problems.append(f"db: {e!r}")
+    if loop_lag.last_lag > READY_MAX_LOOP_LAG:
+        problems.append(f"event loop lag: {loop_lag.last_lag * 1000:.0f} ms")
+    return problems
+
+
+async def _livez(request):
+    return 200, 'text/plain', b'ok'
+
+
+async def _readyz(request):
+    problems = await check_ready()
+    if problems:
+        return 503, 'text/plain', '\n'.join(problems).encode()
+    return 200, 'text/plain', b'ok'
+
+
+async def _metrics(request):
+    return 200, 'text/plain; version=0.0.4; charset=utf-8', metrics.render().encode()
+
+
+async def _root(request):
+    # Старый адрес для пингов Render/BotHost
+    return 200, 'text/plain', b'Bot is running!'
+
+
+class HealthServer(AsyncHTTPServer):
+    """HTTP-сервер /livez, /readyz и /metrics на event loop бота.
+    В режиме webhook на нём же принимаются обновления Telegram"""
+
+    def __init__(self, host='0.0.0.0', port=10000):
+        super().__init__(host, port)
+        self.add_route('/livez', _livez)
+        self.add_route('/readyz', _readyz)
+        self.add_route('/metrics', _metrics)
+        self.add_route('/', _root)
+
+    async def start(self):
+        await super().start()
+        logger.info("Health check server running on port %s", self.port)
@@ -0,0 +1,298 @@
+"""Нагрузочный тест обработчиков бота на синтетических обновлениях.
+
+Строит настоящие Update/CallbackQuery из JSON, подменяет бота заглушкой,
+которая только записывает edit_message_text/send_message, и прогоняет
+типичные цепочки нажатий через start и button_handler на сгенерированной
+базе заданного размера. Обновления проходят через PerUserUpdateProcessor,
+как в Application. Печатает пропускную способность и p50/p99 по маршрутам.
+
+    python loadtest.py --rows 10000 1000000 --users 8 --sessions 200
+
+Выигрыш от параллельной обработки виден при задержке ответа Bot API:
+
+    python loadtest.py --users 16 --concurrency 1 32 --api-latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+import types
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from telegram import Update
+
+import bot
+import db
+from processing import PerUserUpdateProcessor
+
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'fines_loadtest')
+MONTHS_OF_HISTORY = 24
+INSERT_CHUNK = 50000
+
+
+class StubBot:
+    """Заглушка Bot: отвечает через latency секунд и запоминает последний экран чата"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.screens = {}
+        self.calls = defaultdict(int)
+        self._message_id = 0
+
+    async def _network(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _remember(self, chat_id, text, reply_markup):
+        self._message_id += 1
+        self.screens[chat_id] = (text, reply_markup)
+        return types.SimpleNamespace(message_id=self._message_id, text=text)
+
+    async def answer_callback_query(self, callback_query_id, *args, **kwargs):
+        self.calls['answerCallbackQuery'] += 1
+        await self._network()
+        return True
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, reply_markup=None, **kwargs):
+        self.calls['editMessageText'] += 1
+        await self._network()
+        return self._remember(chat_id, text, reply_markup)
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        self.calls['sendMessage'] += 1
+        await self._network()
+        return self._remember(chat_id, text, reply_markup)
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"load{user_id}"}
+
+
+def _message(user_id, text="menu"):
+    return {"message_id": 1, "date": int(time.time()), "text": text,
+            "chat": {"id": user_id, "type": "private"}, "from": _user(user_id)}
+
+
+def start_update(stub, update_id, user_id):
+    message = _message(user_id, "/start")
+    message["entities"] = [{"type": "bot_command", "offset": 0, "length": 6}]
+    return Update.de_json({"update_id": update_id, "message": message}, stub)
+
+
+def callback_update(stub, update_id, user_id, data):
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {"id": str(update_id), "from": _user(user_id), "chat_instance": "1",
+                           "data": data, "message": _message(user_id)},
+    }, stub)
+
+
+# ============= ГЕНЕРАЦИЯ БАЗЫ =============
+
+def _month_starts(count):
+    first = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    months = [first]
+    for _ in range(count - 1):
+        months.append((months[-1] - timedelta(days=1)).replace(day=1))
+    return months
+
+
+def _generate_rows(rows, seed, employee_ids, fine_type_ids):
+    rng = random.Random(seed)
+    months = [int(start.timestamp()) for start in _month_starts(MONTHS_OF_HISTORY)]
+    for _ in range(rows):
+        created_at = rng.choice(months) + rng.randrange(28 * 24 * 3600)
+        yield rng.choice(employee_ids), rng.choice(fine_type_ids), created_at
+
+
+def generate_database(path, rows, seed=42):
+    """Создаёт базу текущей схемы с rows штрафами за последние MONTHS_OF_HISTORY месяцев"""
+    db.shutdown()
+    db.DB_PATH = path
+    bot.init_db()
+    employee_ids = [row[0] for row in db.fetch_all('SELECT id FROM employees')]
+    fine_type_ids = [row[0] for row in db.fetch_all('SELECT id FROM fine_types')]
+    db.shutdown()
+
+    # Быстрая массовая вставка мимо общего слоя: без журнала и fsync
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("BEGIN")
+    batch = []
+    for row in _generate_rows(rows, seed, employee_ids, fine_type_ids):
+        batch.append(row)
+        if len(batch) >= INSERT_CHUNK:
+            conn.executemany('INSERT INTO fines (employee_id, fine_type_id, created_at) VALUES (?,?,?)', batch)
+            batch.clear()
+    if batch:
+        conn.executemany('INSERT INTO fines (employee_id, fine_type_id, created_at) VALUES (?,?,?)', batch)
+    conn.execute("COMMIT")
+    conn.close()
+
+    bot.rebuild_monthly_totals()
+    bot.rebuild_search_index()
+    db.get_connection().execute("ANALYZE")
+
+
+def prepare_database(rows, regenerate=False):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f'fines_{rows}.db')
+    if regenerate or not os.path.exists(path):
+        started = time.perf_counter()
+        if os.path.exists(path):
+            os.remove(path)
+        generate_database(path, rows)
+        print(f"Сгенерирована база {path}: {rows} строк за {time.perf_counter() - started:.1f} с")
+    db.shutdown()
+    db.DB_PATH = path
+    bot.init_db()
+    bot.refresh_admins()
+    bot.render_cache.clear()
+    return path
+
+
+# ============= СЦЕНАРИИ =============
+
+def _buttons(reply_markup, prefix=None):
+    """callback_data кнопок экрана, по желанию только нужного маршрута"""
+    if reply_markup is None:
+        return []
+    result = []
+    for row in reply_markup.inline_keyboard:
+        for button in row:
+            route, _ = bot.router.resolve(button.callback_data)
+            if prefix is None or (route is not None and route.name == prefix):
+                result.append(button.callback_data)
+    return result
+
+
+class VirtualUser:
+    def __init__(self, runner, user_id, rng):
+        self.runner = runner
+        self.user_id = user_id
+        self.rng = rng
+        self.context = types.SimpleNamespace(user_data={}, chat_data={}, bot_data={})
+
+    async def start(self):
+        await self.runner.send('start', start_update(self.runner.stub, self.runner.next_id(), self.user_id),
+                               self.context)
+
+    async def tap(self, data):
+        update = callback_update(self.runner.stub, self.runner.next_id(), self.user_id, data)
+        route, _ = bot.router.resolve(data)
+        await self.runner.send(route.name if route else 'unknown', update, self.context)
+        return self.runner.stub.screens.get(self.user_id, (None, None))[1]
+
+    async def pick(self, screen, prefix):
+        options = _buttons(screen, prefix)
+        return await self.tap(self.rng.choice(options)) if options else None
+
+    async def add_fine_flow(self):
+        screen = await self.tap("add_fine")
+        screen = await self.pick(screen, "emp_fine_")
+        await self.pick(screen, "fine_")
+
+    async def current_month_flow(self):
+        screen = await self.tap("check_fines")
+        await self.pick(screen, "view_employee_")
+
+    async def archive_flow(self):
+        screen = await self.tap("show_months")
+        screen = await self.pick(screen, "month_")
+        await self.pick(screen, "month_emp_")
+
+
+class LoadRunner:
+    def __init__(self, writes_share=0.2, seed=1, concurrency=bot.MAX_CONCURRENT_UPDATES, api_latency=0.0):
+        self.stub = StubBot(api_latency)
+        self.processor = PerUserUpdateProcessor(concurrency)
+        self.latencies = defaultdict(list)
+        self.writes_share = writes_share
+        self.seed = seed
+        self._update_id = 0
+
+    def next_id(self):
+        self._update_id += 1
+        return self._update_id
+
+    async def send(self, route, update, context):
+        # Время считается вместе с ожиданием в очереди процессора
+        started = time.perf_counter()
+        handler = bot.start if route == 'start' else bot.button_handler
+        await self.processor.process_update(update, handler(update, context))
+        self.latencies[route].append(time.perf_counter() - started)
+
+    async def _user_loop(self, user, sessions):
+        await user.start()
+        for _ in range(sessions):
+            roll = user.rng.random()
+            # Добавлять штрафы может только администратор, остальные смотрят
+            if roll < self.writes_share and bot.is_admin(user.user_id):
+                await user.add_fine_flow()
+            elif roll < (1 + self.writes_share) / 2:
+                await user.current_month_flow()
+            else:
+                await user.archive_flow()
+
+    async def run(self, users, sessions):
+        admin = bot.ADMIN_IDS[0]
+        virtual = [VirtualUser(self, admin if index == 0 else 10_000 + index, random.Random(self.seed + index))
+                   for index in range(users)]
+        started = time.perf_counter()
+        await asyncio.gather(*(self._user_loop(user, sessions) for user in virtual))
+        return time.perf_counter() - started
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(rows, elapsed, latencies, concurrency):
+    total = sum(len(values) for values in latencies.values())
+    print(f"\n=== {rows} строк, параллельно {concurrency}: {total} обновлений за {elapsed:.2f} с, "
+          f"{total / elapsed:.1f} обн/с ===")
+    print(f"{'маршрут':<18}{'кол-во':>8}{'p50, мс':>10}{'p99, мс':>10}{'макс, мс':>10}")
+    for route in sorted(latencies):
+        values = latencies[route]
+        print(f"{route:<18}{len(values):>8}{statistics.median(values) * 1000:>10.2f}"
+              f"{_percentile(values, 0.99) * 1000:>10.2f}{max(values) * 1000:>10.2f}")
+
+
+async def run_load(rows, users, sessions, writes_share, regenerate=False,
+                   concurrency=bot.MAX_CONCURRENT_UPDATES, api_latency=0.0):
+    prepare_database(rows, regenerate)
+    runner = LoadRunner(writes_share, concurrency=concurrency, api_latency=api_latency)
+    elapsed = await runner.run(users, sessions)
+    report(rows, elapsed, runner.latencies, concurrency)
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000],
+                        help='размеры базы (например 10000 1000000 10000000)')
+    parser.add_argument('--users', type=int, default=4, help='одновременных пользователей')
+    parser.add_argument('--sessions', type=int, default=100, help='цепочек нажатий на пользователя')
+    parser.add_argument('--writes', type=float, default=0.2, help='доля цепочек с добавлением штрафа')
+    parser.add_argument('--regenerate', action='store_true', help='пересоздать базы')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[bot.MAX_CONCURRENT_UPDATES],
+                        help='сколько обновлений обрабатывать одновременно (1 — как Application по умолчанию)')
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help='задержка ответа заглушки Bot API, с')
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        for concurrency in args.concurrency:
+            asyncio.run(run_load(rows, args.users, args.sessions, args.writes, args.regenerate,
+                                 concurrency, args.api_latency))
+    db.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import atexit
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# Столько записей может ждать вывода; при переполнении новые отбрасываются
+QUEUE_SIZE = 10000
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def log_fields(category, **fields):
+    """extra для записи с категорией и полями key=value:
+    logger.info("Обновление обработано", extra=log_fields('update', user_id=1, route='fine_'))"""
+    return {'category': category, 'fields': fields}
+
+
+def _format_field(value):
+    text = str(value)
+    if not text or any(char in text for char in ' ="\n'):
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+    return text
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Добавляет к сообщению поля записи в виде key=value"""
+
+    def formatMessage(self, record):
+        message = super().formatMessage(record)
+        fields = getattr(record, 'fields', None) or {}
+        suppressed = getattr(record, 'suppressed', 0)
+        pairs = [f"{key}={_format_field(value)}" for key, value in fields.items()]
+        if suppressed:
+            pairs.append(f"suppressed={suppressed}")
+        return ' '.join([message] + pairs) if pairs else message
+
+
+class CategoryFilter(logging.Filter):
+    """Сэмплирование и ограничение частоты записей по категориям.
+
+    Категория — поле category из log_fields, иначе имя логгера. sample_rates:
+    категория -> доля записей, которая проходит (только ниже WARNING).
+    rate_limits: категория -> записей в секунду (ниже ERROR), излишек
+    отбрасывается; следующая прошедшая запись несёт suppressed=N.
+    Фильтр стоит до очереди, поэтому отброшенная запись ничего не стоит"""
+
+    def __init__(self, sample_rates=None, rate_limits=None):
+        super().__init__()
+        self.sample_rates = dict(sample_rates or {})
+        self.rate_limits = dict(rate_limits or {})
+        self.dropped = 0
+        # категория -> [доступно записей, время пополнения, отброшено с последней прошедшей]
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        category = getattr(record, 'category', record.name)
+        if record.levelno < logging.WARNING:
+            rate = self.sample_rates.get(category)
+            if rate is not None and random.random() >= rate:
+                self.dropped += 1
+                return False
+        limit = self.rate_limits.get(category)
+        if limit is None or record.levelno >= logging.ERROR:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets.get(category)
+            if bucket is None:
+                bucket = self._buckets[category] = [limit, now, 0]
+            bucket[0] = min(limit, bucket[0] + (now - bucket[1]) * limit)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.dropped += 1
+                return False
+            bucket[0] -= 1
+            record.suppressed, bucket[2] = bucket[2], 0
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler, который никогда не ждёт: запись форматируется уже в потоке
+    QueueListener, а при полной очереди отбрасывается"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Очередь внутри процесса: запись не нужно сериализовать
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_limits(text):
+    """«update=0.1,callback=20» -> {'update': 0.1, 'callback': 20.0}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in (text or '').split(','))):
+        category, _, value = item.partition('=')
+        limits[category.strip()] = float(value)
+    return limits
+
+
+def setup(level=logging.INFO, sample_rates=None, rate_limits=None, stream=None):
+    """Направляет корневой логгер в очередь; вывод в stream (по умолчанию stderr)
+    делает фоновый QueueListener. Возвращает (handler, filter) для метрик"""
+    log_queue = queue.Queue(QUEUE_SIZE)
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(KeyValueFormatter(FORMAT))
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+
+    handler = NonBlockingQueueHandler(log_queue)
+    category_filter = CategoryFilter(sample_rates, rate_limits)
+    handler.addFilter(category_filter)
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener.start()
+    # При выходе listener дописывает всё, что осталось в очереди
+    atexit.register(listener.stop)
+    return handler, category_filter
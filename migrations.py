@@ -0,0 +1,133 @@
+# Миграции схемы fines.db. Текущая версия хранится в PRAGMA user_version.
+# Новые миграции добавляются в конец списка MIGRATIONS со следующим номером.
+
+
+def initial_schema(conn):
+    # IF NOT EXISTS — чтобы старые базы без версии проходили миграцию без ошибок
+    conn.execute('''CREATE TABLE IF NOT EXISTS fines 
+                 (id INTEGER PRIMARY KEY, employee TEXT, amount INTEGER, 
+                  reason TEXT, date TEXT, month TEXT)''')
+    
+    # Таблица для хранения ID администраторов в БД (на случай, если нужно будет добавлять через бота)
+    conn.execute('''CREATE TABLE IF NOT EXISTS admins 
+                 (user_id INTEGER PRIMARY KEY, username TEXT, added_date TEXT)''')
+
+
+def fines_indexes(conn):
+    # Покрывающий индекс для выборок по сотруднику за месяц: суммы,
+    # группировка по причинам и сортировка по дате читаются из индекса
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_fines_month_employee_date 
+                 ON fines (month, employee, date, amount, reason)''')
+    # Компактный индекс для списка месяцев (SELECT DISTINCT month)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_fines_month ON fines (month)')
+
+
+def monthly_totals(conn):
+    # Материализованные итоги: месяц × сотрудник × причина. Обновляются
+    # в той же транзакции, что и fines (см. _update_monthly_totals в bot.py)
+    conn.execute('''CREATE TABLE IF NOT EXISTS monthly_totals 
+                 (month TEXT, employee TEXT, reason TEXT, 
+                  fine_count INTEGER NOT NULL, total INTEGER NOT NULL, last_date TEXT, 
+                  PRIMARY KEY (month, employee, reason)) WITHOUT ROWID''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_monthly_totals_month ON monthly_totals (month)')
+    conn.execute('DELETE FROM monthly_totals')
+    conn.execute('''INSERT INTO monthly_totals (month, employee, reason, fine_count, total, last_date) 
+                 SELECT month, employee, reason, COUNT(*), SUM(amount), MAX(date) 
+                 FROM fines GROUP BY month, employee, reason''')
+
+
+def fines_keyset_index(conn):
+    # Страницы списка штрафов идут по ключу (date, id): id в индексе явно,
+    # чтобы ORDER BY date DESC, id DESC читался из индекса без сортировки
+    conn.execute('DROP INDEX IF EXISTS idx_fines_month_employee_date')
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_fines_month_employee_date_id 
+                 ON fines (month, employee, date, id, amount, reason)''')
+
+
+def normalized_storage(conn):
+    # Справочники сотрудников и нарушений; штраф хранит только их id и время
+    # в секундах epoch. Месяц больше не хранится в fines: он вычисляется из
+    # created_at, а выборки за месяц идут по диапазону времени
+    conn.execute('''CREATE TABLE IF NOT EXISTS employees 
+                 (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS fine_types 
+                 (id INTEGER PRIMARY KEY, amount INTEGER NOT NULL, reason TEXT NOT NULL, 
+                  UNIQUE (reason, amount))''')
+    conn.execute('''INSERT OR IGNORE INTO employees (name) 
+                 SELECT employee FROM fines GROUP BY employee ORDER BY MIN(id)''')
+    conn.execute('''INSERT OR IGNORE INTO fine_types (amount, reason) 
+                 SELECT amount, reason FROM fines GROUP BY reason, amount ORDER BY MIN(id)''')
+
+    # Старые даты записаны в местном времени с точностью до минуты
+    conn.execute('''CREATE TABLE fines_normalized 
+                 (id INTEGER PRIMARY KEY, 
+                  employee_id INTEGER NOT NULL REFERENCES employees (id), 
+                  fine_type_id INTEGER NOT NULL REFERENCES fine_types (id), 
+                  created_at INTEGER NOT NULL)''')
+    conn.execute('''INSERT INTO fines_normalized (id, employee_id, fine_type_id, created_at) 
+                 SELECT f.id, e.id, t.id, CAST(strftime('%s', f.date, 'utc') AS INTEGER) 
+                 FROM fines f 
+                 JOIN employees e ON e.name = f.employee 
+                 JOIN fine_types t ON t.reason = f.reason AND t.amount = f.amount''')
+    conn.execute('DROP TABLE fines')
+    conn.execute('ALTER TABLE fines_normalized RENAME TO fines')
+    # Список штрафов сотрудника за месяц и его страницы — по диапазону created_at;
+    # fine_type_id в индексе, чтобы пересчёт итогов по причине читался из индекса
+    conn.execute('''CREATE INDEX idx_fines_employee_created 
+                 ON fines (employee_id, created_at, id, fine_type_id)''')
+
+    conn.execute('DROP TABLE monthly_totals')
+    conn.execute('''CREATE TABLE monthly_totals 
+                 (month TEXT, employee_id INTEGER, fine_type_id INTEGER, 
+                  fine_count INTEGER NOT NULL, total INTEGER NOT NULL, last_at INTEGER, 
+                  PRIMARY KEY (month, employee_id, fine_type_id)) WITHOUT ROWID''')
+    conn.execute('CREATE INDEX idx_monthly_totals_month ON monthly_totals (month)')
+    conn.execute('''INSERT INTO monthly_totals (month, employee_id, fine_type_id, fine_count, total, last_at) 
+                 SELECT strftime('%Y-%m', f.created_at, 'unixepoch', 'localtime'), f.employee_id, f.fine_type_id, 
+                        COUNT(*), SUM(t.amount), MAX(f.created_at) 
+                 FROM fines f JOIN fine_types t ON t.id = f.fine_type_id 
+                 GROUP BY 1, 2, 3''')
+
+
+def closed_months(conn):
+    # Закрытые месяцы: их строки fines перенесены в сжатый архив archive_file,
+    # а итоги по сотрудникам и причинам остаются в monthly_totals
+    conn.execute('''CREATE TABLE IF NOT EXISTS closed_months 
+                 (month TEXT PRIMARY KEY, closed_at INTEGER NOT NULL, 
+                  fine_count INTEGER NOT NULL, total INTEGER NOT NULL, archive_file TEXT NOT NULL)''')
+
+
+def fines_search(conn):
+    # Полнотекстовый поиск по имени сотрудника и причине. Индекс external content:
+    # текст читается из представления fines_search, сам индекс хранит только термы.
+    # remove_diacritics 2 снимает диакритику с латиницы (café -> cafe); так же нормализуются и запросы
+    conn.execute('''CREATE VIEW IF NOT EXISTS fines_search AS
+                 SELECT f.id, e.name AS employee, t.reason
+                 FROM fines f
+                 JOIN employees e ON e.id = f.employee_id
+                 JOIN fine_types t ON t.id = f.fine_type_id''')
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS fines_fts USING fts5
+                 (employee, reason, content='fines_search', content_rowid='id',
+                  tokenize='unicode61 remove_diacritics 2')''')
+    # Словарь термов индекса — для исправления опечаток в запросах
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS fines_fts_vocab USING fts5vocab (fines_fts, 'row')")
+    conn.execute("INSERT INTO fines_fts (fines_fts) VALUES ('rebuild')")
+
+
+def persistence(conn):
+    # Состояние диалогов бота (user_data, chat_data и т.д.) в JSON; пишет SQLitePersistence
+    conn.execute('''CREATE TABLE IF NOT EXISTS persistence
+                 (kind TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, updated_at INTEGER NOT NULL,
+                  PRIMARY KEY (kind, key)) WITHOUT ROWID''')
+
+
+MIGRATIONS = [
+    (1, "Таблицы fines и admins", initial_schema),
+    (2, "Индексы по месяцу, сотруднику и дате", fines_indexes),
+    (3, "Таблица итогов monthly_totals", monthly_totals),
+    (4, "Индекс для постраничного списка штрафов", fines_keyset_index),
+    (5, "Справочники сотрудников и нарушений, время в epoch", normalized_storage),
+    (6, "Таблица закрытых месяцев", closed_months),
+    (7, "Полнотекстовый индекс fines_fts", fines_search),
+    (8, "Таблица persistence для состояния диалогов", persistence),
+]
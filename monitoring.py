@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """Измеряет задержку event loop: насколько позже срабатывает sleep"""
+
+    def __init__(self, interval=0.5, warn_threshold=0.1, report_every=120):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.report_every = report_every
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.samples = 0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.samples += 1
+            if lag > self.warn_threshold:
+                logger.warning("Event loop отстаёт на %.1f мс", lag * 1000)
+            if self.samples % self.report_every == 0:
+                logger.info("Задержка event loop: последняя %.1f мс, максимум %.1f мс",
+                            self.last_lag * 1000, self.max_lag * 1000)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def report(self):
+        return {'last_lag_ms': self.last_lag * 1000, 'max_lag_ms': self.max_lag * 1000, 'samples': self.samples}
+
+
+loop_lag = LoopLagMonitor()
+
+
+# ============= МЕТРИКИ В ФОРМАТЕ PROMETHEUS =============
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+               for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Гистограмма с метками; observe() можно вызывать из любого потока"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labelvalues, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge:
+    """Значение, которое вычисляется в момент сбора метрик.
+    С metric_type='counter' так же отдаются внешние монотонные счётчики"""
+
+    def __init__(self, name, documentation, func=None, metric_type='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.metric_type = metric_type
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        if self.func is not None:
+            try:
+                lines.append(f'{self.name} {_format_value(self.func())}')
+            except Exception:
+                logger.exception("Не удалось получить значение метрики %s", self.name)
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._metrics.setdefault(name, Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, func=None, metric_type='gauge'):
+        metric = self._metrics.setdefault(name, Gauge(name, documentation, metric_type=metric_type))
+        if func is not None:
+            metric.func = func
+        return metric
+
+    def register(self, metric):
+        """Добавляет готовую метрику с методом collect()"""
+        return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        """Текст в формате Prometheus exposition 0.0.4"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+HANDLER_LATENCY = metrics.histogram(
+    'bot_handler_seconds', 'Время обработки обновления по маршруту', ('route',))
+DB_QUERY_LATENCY = metrics.histogram(
+    'bot_db_query_seconds', 'Время выполнения функции БД в потоке БД', ('helper',))
+TELEGRAM_API_LATENCY = metrics.histogram(
+    'bot_telegram_api_seconds', 'Время запроса к Telegram Bot API по методу', ('method',),
+    buckets=DEFAULT_BUCKETS + (30.0, 60.0))
+
+metrics.gauge('bot_event_loop_lag_seconds', 'Последняя измеренная задержка event loop',
+              lambda: loop_lag.last_lag)
+metrics.gauge('bot_event_loop_lag_max_seconds', 'Максимальная задержка event loop',
+              lambda: loop_lag.max_lag)
+
+
+class TimedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, который пишет время каждого вызова Bot API в метрики.
+    on_request(метод API) вызывается перед отправкой каждого запроса"""
+
+    def __init__(self, *args, on_request=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_request = on_request
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        if self.on_request is not None:
+            self.on_request(api_method)
+        with TELEGRAM_API_LATENCY.time(api_method):
+            result = await super().do_request(url, method, *args, **kwargs)
+        return result
+
+
+# ============= ПРОФИЛЬ ЗАПУСКА =============
+
+class StartupProfile:
+    """Этапы запуска: начало и конец каждого в секундах от origin (начала импорта).
+    Этапы могут идти параллельно; каждый записывается один раз"""
+
+    name = 'bot_startup_phase_seconds'
+
+    def __init__(self, origin=None):
+        self.origin = time.perf_counter() if origin is None else origin
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, started=None, finished=None):
+        """Записывает этап; started по умолчанию — origin, finished — сейчас"""
+        finished = time.perf_counter() if finished is None else finished
+        started = self.origin if started is None else started
+        with self._lock:
+            self.phases.setdefault(name, (started - self.origin, finished - self.origin))
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    @property
+    def total(self):
+        """Секунды от origin до конца последнего записанного этапа"""
+        with self._lock:
+            return max((finished for started, finished in self.phases.values()), default=0.0)
+
+    def report(self):
+        with self._lock:
+            phases = sorted(self.phases.items(), key=lambda item: item[1][1])
+        parts = [f"{name} {finished - started:.3f} с (к {finished:.3f} с)" for name, (started, finished) in phases]
+        return ', '.join(parts)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} Длительность этапов запуска', f'# TYPE {self.name} gauge']
+        with self._lock:
+            phases = dict(self.phases)
+        for name, (started, finished) in phases.items():
+            lines.append(f'{self.name}{_format_labels(("phase",), (name,))} {_format_value(finished - started)}')
+        return lines
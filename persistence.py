@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+import time
+
+from telegram.ext import BasePersistence
+
+import db
+
+logger = logging.getLogger(__name__)
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранит user_data, chat_data, bot_data, callback_data и состояния диалогов
+    в таблице persistence базы бота, в JSON.
+
+    Application раз в update_interval секунд вызывает update_* для изменённых
+    записей. Здесь они копятся в _pending — повторные изменения одной записи
+    схлопываются, неизменившиеся (bot_data передаётся каждый раз) отбрасываются —
+    и пишутся одной транзакцией в потоке записи БД. При остановке Application
+    вызывает update_* ещё раз и flush(), так что состояние переживает перезапуск.
+    Чтение тоже идёт через поток записи: оно встанет в очередь после миграций,
+    даже если initialize() запущен параллельно с ними
+    """
+
+    def __init__(self, update_interval=10):
+        super().__init__(update_interval=update_interval)
+        # (вид, ключ) -> JSON или None (удалить)
+        self._pending = {}
+        # (вид, ключ) -> JSON, который сейчас лежит в базе
+        self._stored = {}
+        self._batch = None
+
+    @property
+    def pending(self):
+        """Сколько записей ждёт записи в базу"""
+        return len(self._pending)
+
+    # ============= ЧТЕНИЕ =============
+
+    def _load(self, kind):
+        rows = db.fetch_all('SELECT key, data FROM persistence WHERE kind=?', (kind,))
+        for key, data in rows:
+            self._stored[(kind, key)] = data
+        return {key: json.loads(data) for key, data in rows}
+
+    async def _get(self, kind):
+        return await db.write(self._load, kind)
+
+    async def get_user_data(self):
+        return {int(key): data for key, data in (await self._get('user')).items()}
+
+    async def get_chat_data(self):
+        return {int(key): data for key, data in (await self._get('chat')).items()}
+
+    async def get_bot_data(self):
+        return (await self._get('bot')).get('', {})
+
+    async def get_callback_data(self):
+        data = (await self._get('callback')).get('')
+        return None if data is None else (data[0], data[1])
+
+    async def get_conversations(self, name):
+        return {tuple(json.loads(key)): state for key, state in (await self._get(f'conversation:{name}')).items()}
+
+    # ============= ЗАПИСЬ =============
+
+    async def _store(self, kind, key, value):
+        """Ставит запись в очередь (value=None — удалить) и ждёт записи пачки"""
+        item = (kind, key)
+        # Пустой словарь восстанавливать незачем — строка удаляется
+        if value is None or value == {}:
+            data = None
+        else:
+            try:
+                data = _dumps(value)
+            except (TypeError, ValueError):
+                logger.exception("Данные не сериализуются в JSON и не будут сохранены: %s %s", kind, key)
+                return
+        if item not in self._pending and self._stored.get(item) == data:
+            return
+        self._pending[item] = data
+
+        if self._batch is None:
+            self._batch = asyncio.get_running_loop().create_task(self._write_soon())
+        await self._batch
+
+    async def _write_soon(self):
+        # update_* одного прохода Application запускаются вместе (gather) —
+        # даём им всем встать в очередь и пишем одной транзакцией
+        await asyncio.sleep(0)
+        self._batch = None
+        await self._write()
+
+    async def _write(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            await db.write(self._write_pending, pending)
+        except Exception:
+            # Не записанное вернётся в очередь, если его ещё не обновили
+            for item, data in pending.items():
+                self._pending.setdefault(item, data)
+            raise
+        for item, data in pending.items():
+            if data is None:
+                self._stored.pop(item, None)
+            else:
+                self._stored[item] = data
+
+    @staticmethod
+    def _write_pending(pending):
+        now = int(time.time())
+        with db.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO persistence (kind, key, data, updated_at) VALUES (?,?,?,?)
+                ON CONFLICT (kind, key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            ''', [(kind, key, data, now) for (kind, key), data in pending.items() if data is not None])
+            conn.executemany('DELETE FROM persistence WHERE kind=? AND key=?',
+                             [item for item, data in pending.items() if data is None])
+
+    async def update_user_data(self, user_id, data):
+        await self._store('user', str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        await self._store('chat', str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        await self._store('bot', '', data)
+
+    async def update_callback_data(self, data):
+        await self._store('callback', '', data)
+
+    async def update_conversation(self, name, key, new_state):
+        await self._store(f'conversation:{name}', _dumps(list(key)), new_state)
+
+    async def drop_user_data(self, user_id):
+        await self._store('user', str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        await self._store('chat', str(chat_id), None)
+
+    # Данные живут в памяти Application, перечитывать их из базы не нужно
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Дописывает всё, что ещё не записано (вызывается при остановке Application)"""
+        if self._batch is not None:
+            await self._batch
+        await self._write()
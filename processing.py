@@ -0,0 +1,91 @@
+import asyncio
+import sys
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления параллельно, но по одному на пользователя.
+
+    Обновления разных пользователей идут одновременно (не больше
+    max_concurrent_updates), а обновления одного пользователя — строго по
+    очереди в порядке поступления. Поэтому шаги одного диалога
+    (context.user_data['employee'] и т.п.) не пересекаются, а медленная запись
+    администратора не задерживает просмотр у остальных.
+    Обновления без пользователя группируются по чату.
+
+    Семафор BaseUpdateProcessor.process_update берётся до do_process_update,
+    и ожидающие своей очереди обновления одного пользователя занимали бы
+    слоты остальных. Поэтому базовому классу передаётся практически
+    неограниченный лимит, а max_concurrent_updates соблюдает свой семафор,
+    который берётся только после блокировки пользователя.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        # Базовый класс строит свой семафор по свойству max_concurrent_updates
+        self._max_concurrent = sys.maxsize
+        super().__init__(sys.maxsize)
+        self._max_concurrent = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._in_progress = 0
+        # ключ -> [lock, сколько обновлений его ждут или держат]
+        self._locks = {}
+
+    @property
+    def max_concurrent_updates(self):
+        return self._max_concurrent
+
+    @staticmethod
+    def ordering_key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return ('user', update.effective_user.id)
+        if update.effective_chat is not None:
+            return ('chat', update.effective_chat.id)
+        return None
+
+    @property
+    def in_progress(self):
+        """Сколько обновлений обрабатывается прямо сейчас (заняли слот)"""
+        return self._in_progress
+
+    @property
+    def waiting_users(self):
+        """Сколько пользователей сейчас обрабатывается или ждёт своей очереди"""
+        return len(self._locks)
+
+    async def do_process_update(self, update, coroutine):
+        key = self.ordering_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def _run(self, coroutine):
+        async with self._slots:
+            self._in_progress += 1
+            try:
+                await coroutine
+            finally:
+                self._in_progress -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,197 @@
+import string
+
+_DIGITS = string.digits + string.ascii_lowercase
+
+
+def _to_base36(number):
+    if number < 0:
+        raise ValueError(number)
+    digits = ''
+    while True:
+        number, rest = divmod(number, 36)
+        digits = _DIGITS[rest] + digits
+        if not number:
+            return digits
+
+
+def _from_base36(token):
+    if not token or not token.isalnum() or not token.isascii():
+        raise ValueError(token)
+    return int(token, 36)
+
+
+class CallbackCodec:
+    """Компактная кодировка аргументов callback_data по числовым ID.
+
+    Формат версии 2: "2" + код маршрута + ".арг" для каждого аргумента, где
+    сотрудник и нарушение — base36 их id в таблицах employees и fine_types,
+    месяц — base36 от year*12 + month - 1, число — base36. Имена в callback_data
+    не попадают. Справочники передаются в load() после открытия базы.
+
+    id в базе не меняются и не переиспользуются, поэтому уже отправленная кнопка
+    разбирается в того же сотрудника и то же нарушение после любого деплоя.
+    Кнопки версии 1 (индексы в списках EMPLOYEES / FINES) не разбираются.
+    Старые кнопки без номера версии разбирает роутер по префиксу
+    (см. CallbackRouter.resolve).
+    """
+
+    VERSION = '2'
+    SEPARATOR = '.'
+    MAX_BYTES = 64  # Ограничение Telegram на callback_data
+
+    def __init__(self):
+        self.employee_ids = {}
+        self.employees = {}
+        self.fine_ids = frozenset()
+
+    def load(self, employees, fine_ids):
+        """employees: id -> имя, fine_ids: id нарушений"""
+        self.employees = dict(employees)
+        self.employee_ids = {name: employee_id for employee_id, name in self.employees.items()}
+        self.fine_ids = frozenset(fine_ids)
+
+    def encode_value(self, kind, value):
+        if kind == 'employee':
+            employee_id = self.employee_ids.get(value)
+            if employee_id is None:
+                raise ValueError(f"Сотрудника нет в справочнике: {value!r}")
+            return _to_base36(employee_id)
+        if kind == 'month':
+            year, month_num = value.split('-')
+            return _to_base36(int(year) * 12 + int(month_num) - 1)
+        if kind in ('fine', 'int'):
+            return _to_base36(value)
+        raise ValueError(f"Неизвестный тип аргумента: {kind}")
+
+    def decode_value(self, kind, token):
+        if kind == 'employee':
+            return self.employees[_from_base36(token)]
+        if kind == 'month':
+            year, month_index = divmod(_from_base36(token), 12)
+            return f"{year:04d}-{month_index + 1:02d}"
+        if kind == 'fine':
+            fine_id = _from_base36(token)
+            if fine_id not in self.fine_ids:
+                raise KeyError(fine_id)
+            return fine_id
+        if kind == 'int':
+            return _from_base36(token)
+        raise ValueError(f"Неизвестный тип аргумента: {kind}")
+
+    def encode(self, code, kinds, values):
+        if len(kinds) != len(values):
+            raise ValueError(f"Маршрут {code!r} ожидает {len(kinds)} аргумент(ов)")
+        tokens = [self.encode_value(kind, value) for kind, value in zip(kinds, values)]
+        data = self.SEPARATOR.join([self.VERSION + code] + tokens)
+        if len(data.encode()) > self.MAX_BYTES:
+            raise ValueError(f"callback_data длиннее {self.MAX_BYTES} байт: {data!r}")
+        return data
+
+    def split(self, data):
+        """Возвращает (код маршрута, токены) для данных текущей версии или None"""
+        if not data.startswith(self.VERSION):
+            return None
+        head, *tokens = data.split(self.SEPARATOR)
+        return head[len(self.VERSION):], tokens
+
+
+class Route:
+    """Зарегистрированный маршрут callback_data"""
+
+    __slots__ = ('name', 'handler', 'admin_only', 'parse', 'code', 'kinds')
+
+    def __init__(self, name, handler, admin_only, parse, code=None, kinds=()):
+        self.name = name
+        self.handler = handler
+        self.admin_only = admin_only
+        self.parse = parse
+        self.code = code
+        self.kinds = kinds
+
+
+class CallbackRouter:
+    """Разбирает callback_data в маршрут и аргументы и находит обработчик по словарю.
+
+    Маршрут без аргумента регистрируется точным именем ("check_fines"), маршрут
+    с аргументом — префиксом с подчёркиванием на конце ("month_emp_"). Префикс
+    ищется по первым частям строки до '_', начиная с самого длинного, поэтому
+    "month_emp_..." не перехватывается маршрутом "month_".
+
+    Маршруты с аргументами описываются в schema: имя -> (короткий код, типы
+    аргументов). Новые кнопки строятся через data() в компактном формате
+    CallbackCodec, а префиксный разбор остаётся для кнопок, отправленных
+    до перехода на этот формат.
+    """
+
+    def __init__(self, codec, schema):
+        self.codec = codec
+        self.schema = dict(schema)
+        self._exact = {}
+        self._prefixed = {}
+        self._by_code = {}
+        self._max_prefix_parts = 1
+
+    def data(self, name, *values):
+        """Строит callback_data для маршрута"""
+        if name not in self.schema:
+            return name
+        code, kinds = self.schema[name]
+        return self.codec.encode(code, kinds, values)
+
+    def route(self, name, admin_only=False, parse=None):
+        """Декоратор регистрации обработчика.
+
+        parse(raw) превращает строку после префикса в кортеж аргументов
+        обработчика для кнопок старого формата; ValueError/KeyError/IndexError
+        означают битые данные.
+        """
+        def decorator(handler):
+            if name in self._exact or name in self._prefixed:
+                raise ValueError(f"Маршрут {name!r} уже зарегистрирован")
+            code, kinds = self.schema.get(name, (None, ()))
+            if name.endswith('_'):
+                route = Route(name, handler, admin_only, parse or (lambda raw: (raw,)), code, kinds)
+                self._prefixed[name] = route
+                self._max_prefix_parts = max(self._max_prefix_parts, name.count('_'))
+            else:
+                route = Route(name, handler, admin_only, parse or (lambda raw: ()), code, kinds)
+                self._exact[name] = route
+            if code is not None:
+                self._by_code[code] = route
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        """Возвращает (маршрут, аргументы) или (None, None), если маршрут неизвестен"""
+        if not data:
+            return None, None
+
+        encoded = self.codec.split(data)
+        if encoded is not None:
+            code, tokens = encoded
+            route = self._by_code.get(code)
+            if route is None or len(tokens) != len(route.kinds):
+                return None, None
+            try:
+                return route, tuple(self.codec.decode_value(kind, token)
+                                    for kind, token in zip(route.kinds, tokens))
+            except (ValueError, KeyError, IndexError):
+                return None, None
+
+        route = self._exact.get(data)
+        raw = ''
+        if route is None:
+            parts = data.split('_', self._max_prefix_parts)
+            for count in range(min(self._max_prefix_parts, len(parts) - 1), 0, -1):
+                prefix = '_'.join(parts[:count]) + '_'
+                route = self._prefixed.get(prefix)
+                if route is not None:
+                    raw = data[len(prefix):]
+                    break
+            else:
+                return None, None
+
+        try:
+            return route, route.parse(raw)
+        except (ValueError, KeyError, IndexError):
+            return None, None
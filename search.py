@@ -0,0 +1,88 @@
+import difflib
+import re
+import unicodedata
+from datetime import datetime, timedelta
+
+# Насколько слово запроса должно быть похоже на терм индекса, чтобы считаться опечаткой
+FUZZY_CUTOFF = 0.75
+# Короче этого слова ищутся только по префиксу, без исправления опечаток
+FUZZY_MIN_LENGTH = 3
+FUZZY_CANDIDATES = 3
+
+# Как у unicode61: подчёркивание — разделитель
+_WORD = re.compile(r'[^\W_]+')
+_PERIOD = re.compile(r'^(\d{4}-\d{2}(?:-\d{2})?)(?:\.\.(\d{4}-\d{2}(?:-\d{2})?))?$')
+
+
+# unicode61 снимает диакритику только с латиницы: «й» и «ё» остаются собой
+_LATIN_END = '\u0250'
+
+
+def _fold_char(char):
+    decomposed = unicodedata.normalize('NFD', char)
+    if len(decomposed) > 1 and decomposed[0] < _LATIN_END:
+        return ''.join(part for part in decomposed if not unicodedata.combining(part))
+    return char
+
+
+def fold(text):
+    """Нормализация как у токенизатора unicode61 remove_diacritics 2: регистр и диакритика"""
+    return ''.join(_fold_char(char) for char in text.lower())
+
+
+def tokens(text):
+    """Слова текста так, как их индексирует fines_fts"""
+    return [fold(word) for word in _WORD.findall(text)]
+
+
+def _period_start(value, end=False):
+    """ГГГГ-ММ или ГГГГ-ММ-ДД -> начало периода или (end=True) начало следующего"""
+    if len(value) == 7:
+        start = datetime.strptime(value, '%Y-%m')
+        if not end:
+            return start
+        return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    start = datetime.strptime(value, '%Y-%m-%d')
+    return start + timedelta(days=1) if end else start
+
+
+def parse_query(text):
+    """Разбирает запрос на слова и период: «грязное 2024-07..2024-09».
+    Возвращает (слова, начало, конец) — время в секундах epoch или None.
+    ValueError — неверная дата"""
+    words, start, end = [], None, None
+    for part in text.split():
+        period = _PERIOD.match(part)
+        if period:
+            first, last = period.group(1), period.group(2) or period.group(1)
+            start = int(_period_start(first).timestamp())
+            end = int(_period_start(last, end=True).timestamp())
+        else:
+            words.extend(tokens(part))
+    return words, start, end
+
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def expand_word(word, vocabulary):
+    """Выражение FTS5 для слова: префиксный поиск, если в индексе есть термы
+    с таким началом, иначе — по похожим началам термов (опечатка). None — нет совпадений"""
+    if any(term.startswith(word) for term in vocabulary):
+        return _quote(word) + '*'
+    if len(word) < FUZZY_MIN_LENGTH:
+        return None
+    prefixes = {term[:len(word)] for term in vocabulary}
+    close = difflib.get_close_matches(word, prefixes, n=FUZZY_CANDIDATES, cutoff=FUZZY_CUTOFF)
+    if not close:
+        return None
+    return '(' + ' OR '.join(_quote(prefix) + '*' for prefix in close) + ')'
+
+
+def build_match(words, vocabulary):
+    """Запрос MATCH: все слова должны найтись. None — какое-то слово не найдено"""
+    expressions = [expand_word(word, vocabulary) for word in words]
+    if not expressions or None in expressions:
+        return None
+    return ' AND '.join(expressions)